@@ -0,0 +1,152 @@
+#----------------------------------------------------------------------------#
+# Read-only JSON API, served as an ASGI application.
+#
+#   GET /api/venues                 venues grouped by area
+#   GET /api/venues/<id>            one venue with its past and upcoming shows
+#   GET /api/artists
+#   GET /api/artists/<id>
+#   GET /api/shows[?after=<cursor>] one page of shows and the next cursor
+#   GET /api/venues/near?lat=&lng=[&radius=<km>][&limit=<n>]
+#                                   venues nearest to a point
+#
+# The payloads are built by the same functions as the HTML pages in app.py.
+# Run it next to the Flask app with any ASGI server, e.g.
+#
+#   uvicorn api:application --workers 4
+#
+# SQLAlchemy 1.3 has no asyncio support, so the queries run on a thread pool
+# no larger than the connection pool (DB_POOL_SIZE + DB_MAX_OVERFLOW) and
+# the event loop never blocks on the database. Requests beyond that wait on
+# the loop, which costs nothing per waiting request, instead of in a worker
+# thread or in the pool's checkout queue.
+#----------------------------------------------------------------------------#
+
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from werkzeug.exceptions import HTTPException
+
+from app import app, venue_areas, venue_detail, artist_list, artist_detail, show_page, near_arguments
+from geo import venues_near
+from models import db
+
+
+def venues(query):
+  return {"areas": venue_areas()}
+
+
+def near(query):
+  arguments = near_arguments({key: values[0] for key, values in query.items()})
+  return {"venues": venues_near(*arguments)}
+
+
+def venue(query, id):
+  return venue_detail(int(id))
+
+
+def artists(query):
+  return {"artists": artist_list()}
+
+
+def artist(query, id):
+  return artist_detail(int(id))
+
+
+def shows(query):
+  data, next_cursor = show_page(query.get('after', [None])[0])
+  return {"shows": data, "next_cursor": next_cursor}
+
+
+ROUTES = [
+  (re.compile(r'^/api/venues$'), venues),
+  (re.compile(r'^/api/venues/near$'), near),
+  (re.compile(r'^/api/venues/(?P<id>\d+)$'), venue),
+  (re.compile(r'^/api/artists$'), artists),
+  (re.compile(r'^/api/artists/(?P<id>\d+)$'), artist),
+  (re.compile(r'^/api/shows$'), shows),
+]
+
+MESSAGES = {
+  400: 'bad request',
+  404: 'resource not found',
+  405: 'method not allowed',
+}
+
+
+def to_json(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  raise TypeError('%r is not JSON serializable' % (value,))
+
+
+class ReadAPI(object):
+
+  def __init__(self, flask_app, workers=None):
+    self.flask_app = flask_app
+    if workers is None:
+      workers = flask_app.config['DB_POOL_SIZE'] + flask_app.config['DB_MAX_OVERFLOW']
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='api')
+
+  def run(self, handler, query, params):
+    # Runs on a worker thread: one request context, and so one session and
+    # one clock.request_now(), per call.
+    with self.flask_app.test_request_context():
+      try:
+        return 200, handler(query, **params)
+      except HTTPException as e:
+        return e.code, None
+      finally:
+        db.session.remove()
+
+  async def dispatch(self, method, path, query):
+    for pattern, handler in ROUTES:
+      match = pattern.match(path)
+      if match:
+        break
+    else:
+      return 404, None
+    if method != 'GET':
+      return 405, None
+    loop = asyncio.get_running_loop()
+    status, data = await loop.run_in_executor(
+      self.executor, self.run, handler, query, match.groupdict())
+    if status == 200 and data is None:
+      status = 404
+    return status, data
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'lifespan':
+      while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+          await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+          self.executor.shutdown(wait=True)
+          await send({'type': 'lifespan.shutdown.complete'})
+          return
+    if scope['type'] != 'http':
+      return
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    status, data = await self.dispatch(scope['method'], scope['path'], query)
+    if status == 200:
+      body = {"success": True, "data": data}
+    else:
+      body = {"success": False, "error": status, "message": MESSAGES.get(status, 'error')}
+    payload = json.dumps(body, default=to_json).encode('utf-8')
+    await send({
+      'type': 'http.response.start',
+      'status': status,
+      'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(payload)).encode('ascii')),
+      ],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+application = ReadAPI(app)
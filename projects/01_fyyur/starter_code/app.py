@@ -4,17 +4,29 @@
 
 import dateutil.parser
 import babel
-import sys
-import datetime
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+import babel.dates
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, Markup, stream_with_context, jsonify
 from flask_moment import Moment
-from sqlalchemy import func
-import logging
+from sqlalchemy import case, func, tuple_
 from flask_migrate import Migrate
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
-from models import db, Venue, Artist, Show
+from models import db, loading, Venue, Artist, Show, Genre, venue_genre, artist_genre
+from search import search_by_name
+from cache import fragment_cache, venue_key, artist_key
+from cli import fyyur_cli
+from export import EXPORTS, MIMETYPES, export_lines
+from dbpool import register_metrics
+import counters
+from conditional import conditional
+from booking import book_shows
+from clock import as_utc, request_now
+from geo import venues_near
+from sqlprofile import sql_profiler
+from logpipeline import log_pipeline
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -24,6 +36,10 @@ app.config.from_object('config')
 moment = Moment(app)
 db.init_app(app)
 migrate = Migrate(app, db)
+fragment_cache.init_app(app)
+app.cli.add_command(fyyur_cli)
+register_metrics(app, db)
+sql_profiler.init_app(app)
 
 #----------------------------------------------------------------------------#
 # Models.
@@ -33,16 +49,55 @@ migrate = Migrate(app, db)
 # Filters.
 #----------------------------------------------------------------------------#
 
+# Patterns are compiled once at import instead of on every call.
+DATETIME_FORMATS = {
+  'full': babel.dates.parse_pattern("EEEE MMMM, d, y 'at' h:mma"),
+  'medium': babel.dates.parse_pattern("EE MM, dd, y h:mma"),
+}
+DATETIME_LOCALE = babel.Locale.parse('en')
+DATETIME_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+  # Takes datetime objects as they come out of the database; strings are
+  # still parsed for callers that pass them.
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  if format in DATETIME_FORMATS:
+    return DATETIME_FORMATS[format].apply(value, DATETIME_LOCALE)
+  return babel.dates.format_datetime(value, format, locale=DATETIME_LOCALE)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def is_past(now):
+  # Classifies shows in the query itself, against the request's one
+  # timestamp, so a show can never end up in both lists (or in neither).
+  return (Show.start_time < now).label('is_past')
+
+def split_shows(shows):
+  past_shows = []
+  upcoming_shows = []
+  for show in shows:
+    if show.is_past:
+      past_shows.append(show)
+    else:
+      upcoming_shows.append(show)
+  return past_shows, upcoming_shows
+
+def show_counts(now):
+  # Past and upcoming counts as SQL aggregates against the same timestamp.
+  # The detail queries compute them as window aggregates over their own rows,
+  # so the counts arrive with the shows, without a second statement.
+  return (func.count(case([(Show.start_time < now, 1)])),
+          func.count(case([(Show.start_time >= now, 1)])))
+
+def counts_of(shows):
+  return (shows[0].past_shows_count, shows[0].upcoming_shows_count) if shows else (0, 0)
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -56,77 +111,119 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@conditional('venue')
 def venues():
+  return render_template('pages/venues.html', areas=venue_areas())
+
+def venue_areas():
+  # A single ordered scan of the columns the listing needs. Venues of the same
+  # area come back next to each other, so the areas are built in one pass.
+  venues = db.session.query(Venue.id, Venue.name, Venue.city, Venue.state) \
+    .order_by(Venue.state, Venue.city, Venue.id).all()
+
   data=[]
-  venue_data = {}
-  venues = Venue.query.all()
-  venues_areas = Venue.query.distinct(Venue.city).all()
-
-  for venue_area in venues_areas:
-    venue_data = {
-      "city": venue_area.city,
-      "state": venue_area.state,
-      "venues": []
-    }
-    for venue in venues:
-      if venue.city == venue_area.city:
-        venue_data['venues'].append({
+  for (city, state), area_venues in groupby(venues, key=lambda venue: (venue.city, venue.state)):
+    data.append({
+      "city": city,
+      "state": state,
+      "venues": [{
         "id": venue.id,
         "name": venue.name,
-      })
-    data.append(venue_data)
-    data.sort(key=lambda s: s['state'])
-  return render_template('pages/venues.html', areas=data)
+      } for venue in area_venues]
+    })
+  return data
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  search_term = request.form.get('search_term')
-  venues = Venue.query.filter(Venue.name.ilike('%' + search_term + '%'))
+  search_term = request.form.get('search_term', '')
+  count, venues = search_by_name(Venue, search_term)
   response = {
-    "count": venues.count(),
-    "data": []
+    "count": count,
+    "data": [{
+      "id": id,
+      "name": name,
+    } for id, name in venues]
   }
-  veneu_data = {}
-  for venue in venues:
-    veneu_data = {
-      "id": venue.id,
-      "name": venue.name,
-    }
-    response['data'].append(veneu_data)
-
-
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+NEAR_DEFAULT_LIMIT = 10
+NEAR_MAX_LIMIT = 100
+
+def near_arguments(args):
+  # ?lat=37.77&lng=-122.42[&radius=<km>][&limit=<n>]; without a radius the
+  # nearest venues are returned however far away they are.
+  try:
+    latitude = float(args['lat'])
+    longitude = float(args['lng'])
+    radius = float(args['radius']) if args.get('radius') else None
+    limit = int(args.get('limit') or NEAR_DEFAULT_LIMIT)
+  except (KeyError, ValueError):
+    abort(400)
+  if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) \
+      or (radius is not None and not radius > 0) or not 0 < limit <= NEAR_MAX_LIMIT:
+    abort(400)
+  return latitude, longitude, radius, limit
+
+@app.route('/venues/near')
+def near_venues():
+  latitude, longitude, radius, limit = near_arguments(request.args)
+  venues = venues_near(latitude, longitude, radius, limit)
+  if radius is None:
+    search_term = 'nearest to %g, %g' % (latitude, longitude)
+  else:
+    search_term = 'within %g km of %g, %g' % (radius, latitude, longitude)
+  response = {
+    "count": len(venues),
+    "data": venues,
+  }
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
+@conditional('venue', 'genre', 'show', 'artist', period=60)
 def show_venue(venue_id):
-  
-  venue = Venue.query.get(venue_id)
-  
-  past_shows = []
-  upcoming_shows = []
-
-  past_shows = db.session.query(Show).join(Venue).filter(Show.venue_id == venue_id).filter(Show.start_time < datetime.now()).all()
-  upcoming_shows = db.session.query(Show).join(Venue).filter(Show.venue_id == venue_id).filter(Show.start_time > datetime.now()).all()
-
-
-  # The solution without JOINs
-  # show_data = {}
-  # for show in venue.shows:
-  #   show_data = {
-  #     "artist_id": show.artist.id,
-  #     "artist_name": show.artist.name,
-  #     "artist_image_link": show.artist.image_link,
-  #     "start_time": show.start_time.strftime("%d/%m/%Y, %H:%M")
-  #   }
-  #   if show.start_time < datetime.now():
-  #     past_shows.append(show_data)
-  #   else:
-  #     upcoming_shows.append(show_data)
+  detail = fragment_cache.get(venue_key(venue_id))
+  if detail is None:
+    detail = render_venue_detail(venue_id)
+  return render_template('pages/show_venue.html', name=detail['name'], detail=Markup(detail['html']))
+
+def render_venue_detail(venue_id):
+  data = venue_detail(venue_id)
+  if data is None:
+    abort(404)
+  detail = {
+    "name": data["name"],
+    "html": render_template('fragments/venue.html', venue=data),
+  }
+  upcoming_shows = data["upcoming_shows"]
+  fragment_cache.set(venue_key(venue_id), detail,
+                     expires=upcoming_shows[0]["start_time"] if upcoming_shows else None)
+  return detail
+
+def venue_detail(venue_id):
+  venue = Venue.query.options(*loading(Venue, genres='joined')).get(venue_id)
+  if venue is None:
+    return None
+
+  now = request_now()
+  past_count, upcoming_count = show_counts(now)
+  shows = db.session.query(
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'),
+      Show.start_time,
+      is_past(now),
+      past_count.over().label('past_shows_count'),
+      upcoming_count.over().label('upcoming_shows_count')) \
+    .join(Artist, Show.artist_id == Artist.id) \
+    .filter(Show.venue_id == venue_id, Show.start_time.isnot(None)) \
+    .order_by(Show.start_time).all()
+  past_shows, upcoming_shows = split_shows(shows)
+  past_shows_count, upcoming_shows_count = counts_of(shows)
 
   data = {
     "id": venue.id,
     "name": venue.name,
-    "genres": ''.join(list(filter(lambda x : x!= '{' and x!='}', venue.genres ))).split(','),
+    "genres": [genre.name for genre in venue.genres],
     "address": venue.address,
     "city": venue.city,
     "state": venue.state,
@@ -138,20 +235,20 @@ def show_venue(venue_id):
     "image_link": venue.image_link,
     "past_shows": [{
       "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": show.start_time.strftime("%d/%m/%Y, %H:%M")
+      "artist_name": show.artist_name,
+      "artist_image_link": show.artist_image_link,
+      "start_time": show.start_time
       }for show in past_shows],
     "upcoming_shows": [{
       "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": show.start_time.strftime("%d/%m/%Y, %H:%M")
+      "artist_name": show.artist_name,
+      "artist_image_link": show.artist_image_link,
+      "start_time": show.start_time
       }for show in upcoming_shows],
-    "past_shows_count": len(past_shows),
-    "upcoming_shows_count": len(upcoming_shows),
+    "past_shows_count": past_shows_count,
+    "upcoming_shows_count": upcoming_shows_count,
   }
-  return render_template('pages/show_venue.html', venue=data)
+  return data
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -172,29 +269,25 @@ def create_venue_submission():
        venue_seeking_talent = True
      else:
        pass
-     tmp_genres = form.genres.data
-     list_of_geners = ','.join(tmp_genres)
      newVenue = Venue(
         name = form.name.data,
         city = form.city.data,
         state = form.state.data,
         address = form.address.data,
         phone = form.phone.data,
-        genres = list_of_geners,
+        genres = Genre.get_or_create(form.genres.data),
         seeking_talent = venue_seeking_talent,
         seeking_description = form.seeking_description.data if venue_seeking_talent else '',
         facebook_link = form.facebook_link.data,
         image_link = form.image_link.data,
         website = form.website.data,
        )
-     print(newVenue)
      db.session.add(newVenue)
      db.session.commit()
-   except Exception as e:
-     print(e)
+   except Exception:
      error = True
      db.session.rollback()
-     print(sys.exc_info())
+     app.logger.exception('Venue %r could not be listed', request.form.get('name'))
    finally:
      db.session.close()
    if error:
@@ -220,8 +313,12 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional('artist')
 def artists():
-  artist_list = Artist.query.all()
+  return render_template('pages/artists.html', artists=artist_list())
+
+def artist_list():
+  artist_list = Artist.query.options(*loading(Artist)).order_by(Artist.id).all()
   artist_data = {}
   data=[]
 
@@ -232,55 +329,67 @@ def artists():
     }
     data.append(artist_data)
   
-  return render_template('pages/artists.html', artists=data)
+  return data
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-
-  search_term = request.form.get('search_term')
-  artists = Artist.query.filter(Artist.name.ilike('%' + search_term + '%'))
+  search_term = request.form.get('search_term', '')
+  count, artists = search_by_name(Artist, search_term)
   response = {
-    "count": artists.count(),
-    "data": []
+    "count": count,
+    "data": [{
+      "id": id,
+      "name": name,
+    } for id, name in artists]
   }
-  artist_data = {}
-  for artist in artists:
-    artist_data = {
-      "id": artist.id,
-      "name": artist.name,
-    }
-    response['data'].append(artist_data)
-
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
+@conditional('artist', 'genre', 'show', 'venue', period=60)
 def show_artist(artist_id):
-  artist = Artist.query.filter_by(id=artist_id).first()
-  
-  past_shows = []
-  upcoming_shows = []
-
-  past_shows = db.session.query(Show).join(Artist).filter(Show.artist_id == artist_id).filter(Show.start_time < datetime.now()).all()
-  upcoming_shows = db.session.query(Show).join(Artist).filter(Show.artist_id == artist_id).filter(Show.start_time > datetime.now()).all()
-
-  # The solution without JOINs
-  # show_data = {}
-  # for show in artist.shows:
-  #   show_data = {
-  #     "venue_id": show.venue.id,
-  #     "venue_name": show.venue.name,
-  #     "venue_image_link": show.venue.image_link,
-  #     "start_time": show.start_time.strftime("%d/%m/%Y, %H:%M")
-  #   }
-  #   if show.start_time < datetime.now():
-  #     past_shows.append(show_data)
-  #   else:
-  #     upcoming_shows.append(show_data)
+  detail = fragment_cache.get(artist_key(artist_id))
+  if detail is None:
+    detail = render_artist_detail(artist_id)
+  return render_template('pages/show_artist.html', name=detail['name'], detail=Markup(detail['html']))
+
+def render_artist_detail(artist_id):
+  artist_data = artist_detail(artist_id)
+  if artist_data is None:
+    abort(404)
+  detail = {
+    "name": artist_data["name"],
+    "html": render_template('fragments/artist.html', artist=artist_data),
+  }
+  upcoming_shows = artist_data["upcoming_shows"]
+  fragment_cache.set(artist_key(artist_id), detail,
+                     expires=upcoming_shows[0]["start_time"] if upcoming_shows else None)
+  return detail
+
+def artist_detail(artist_id):
+  artist = Artist.query.options(*loading(Artist, genres='joined')).filter_by(id=artist_id).first()
+  if artist is None:
+    return None
+
+  now = request_now()
+  past_count, upcoming_count = show_counts(now)
+  shows = db.session.query(
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Venue.image_link.label('venue_image_link'),
+      Show.start_time,
+      is_past(now),
+      past_count.over().label('past_shows_count'),
+      upcoming_count.over().label('upcoming_shows_count')) \
+    .join(Venue, Show.venue_id == Venue.id) \
+    .filter(Show.artist_id == artist_id, Show.start_time.isnot(None)) \
+    .order_by(Show.start_time).all()
+  past_shows, upcoming_shows = split_shows(shows)
+  past_shows_count, upcoming_shows_count = counts_of(shows)
 
   artist_data={
     "id": artist.id,
     "name": artist.name,
-    "genres": ''.join(list(filter(lambda x : x!= '{' and x!='}', artist.genres ))).split(','),
+    "genres": [genre.name for genre in artist.genres],
     "city": artist.city,
     "state": artist.state,
     "phone": artist.phone,
@@ -291,20 +400,20 @@ def show_artist(artist_id):
     "image_link": artist.image_link,
     "past_shows": [{
       "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "venue_image_link": show.venue.image_link,
-      "start_time": show.start_time.strftime("%d/%m/%Y, %H:%M")
+      "venue_name": show.venue_name,
+      "venue_image_link": show.venue_image_link,
+      "start_time": show.start_time
       }for show in past_shows],
     "upcoming_shows": [{
       "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "venue_image_link": show.venue.image_link,
-      "start_time": show.start_time.strftime("%d/%m/%Y, %H:%M")
+      "venue_name": show.venue_name,
+      "venue_image_link": show.venue_image_link,
+      "start_time": show.start_time
       }for show in upcoming_shows],
-    "past_shows_count": len(past_shows),
-    "upcoming_shows_count": len(upcoming_shows),
+    "past_shows_count": past_shows_count,
+    "upcoming_shows_count": upcoming_shows_count,
   }
-  return render_template('pages/show_artist.html', artist=artist_data)
+  return artist_data
 
 #  Update
 #  ----------------------------------------------------------------
@@ -352,30 +461,25 @@ def create_artist_submission():
        artist_seeking_venue = True
      else:
        pass
-    
-     tmp_genres = form.genres.data
-     list_of_geners = ','.join(tmp_genres)
 
      newArtist = Artist(
         name = form.name.data,
         city = form.city.data,
         state = form.state.data,
         phone = form.phone.data,
-        genres = list_of_geners,
+        genres = Genre.get_or_create(form.genres.data),
         seeking_venue = artist_seeking_venue,
         seeking_description = form.seeking_description.data if artist_seeking_venue else '',
         facebook_link = form.facebook_link.data,
         image_link = form.image_link.data,
         website = form.website.data,
        )
-     print(newArtist)
      db.session.add(newArtist)
      db.session.commit()
-   except Exception as e:
-     print(e)
+   except Exception:
      error = True
      db.session.rollback()
-     print(sys.exc_info())
+     app.logger.exception('Artist %r could not be listed', request.form.get('name'))
    finally:
      db.session.close()
    if error:
@@ -390,28 +494,113 @@ def create_artist_submission():
     flash('Errors ' + str(message))
   return render_template('pages/home.html')
 
+#  Genres
+#  ----------------------------------------------------------------
+
+@app.route('/genres/<genre_name>')
+def show_genre(genre_name):
+  # Both lists are read through the (genre_id, ...) indexes of the
+  # association tables; no genre strings are parsed.
+  genre = Genre.query.filter_by(name=genre_name).first_or_404()
+  venues = db.session.query(Venue.id, Venue.name) \
+    .join(venue_genre, venue_genre.c.venue_id == Venue.id) \
+    .filter(venue_genre.c.genre_id == genre.id) \
+    .order_by(Venue.name).all()
+  artists = db.session.query(Artist.id, Artist.name) \
+    .join(artist_genre, artist_genre.c.artist_id == Artist.id) \
+    .filter(artist_genre.c.genre_id == genre.id) \
+    .order_by(Artist.name).all()
+
+  data = {
+    "name": genre.name,
+    "venues": [{
+      "id": venue.id,
+      "name": venue.name,
+    } for venue in venues],
+    "artists": [{
+      "id": artist.id,
+      "name": artist.name,
+    } for artist in artists],
+  }
+  return render_template('pages/show_genre.html', genre=data)
+
+#  Top venues and artists
+#  ----------------------------------------------------------------
+
+TOP_LIMIT = 10
+
+@app.route('/top')
+def top():
+  # Read straight off the denormalized counters (see counters.py) through
+  # their (upcoming_shows_count, id) indexes; no show rows are touched.
+  data = {}
+  for key, model in (("venues", Venue), ("artists", Artist)):
+    rows = db.session.query(model.id, model.name, model.upcoming_shows_count, model.past_shows_count) \
+      .order_by(model.upcoming_shows_count.desc(), model.id.desc()) \
+      .limit(TOP_LIMIT).all()
+    data[key] = [{
+      "id": row.id,
+      "name": row.name,
+      "upcoming_shows_count": row.upcoming_shows_count,
+      "past_shows_count": row.past_shows_count,
+    } for row in rows]
+  return render_template('pages/top.html', **data)
+
 #  Shows
 #  ----------------------------------------------------------------
 
+SHOWS_PER_PAGE = 30
+
+def parse_show_cursor(cursor):
+  # Cursors have the form "<start_time isoformat>,<show id>", i.e. the sort
+  # key of the last show on the previous page.
+  try:
+    start_time, show_id = cursor.rsplit(',', 1)
+    return as_utc(datetime.fromisoformat(start_time)), int(show_id)
+  except ValueError:
+    abort(400)
+
 @app.route('/shows')
+@conditional('show', 'venue', 'artist')
 def shows():
-  shows = Show.query.all()
-  show_data = {}
-  data=[]
-  
-  for show in shows:
-    venues_for_this_show = show.venue
-    artist_for_this_show = show.artist
-    show_data = {
-      "venue_id": show.venue_id,
-      "venue_name": venues_for_this_show.name,
-      "artist_id": artist_for_this_show.id,
-      "artist_name": artist_for_this_show.name,
-      "artist_image_link": artist_for_this_show.image_link,
-      "start_time": format_datetime(show.start_time.strftime("%d/%m/%Y, %H:%M"))
-      }
-    data.append(show_data)
-  return render_template('pages/shows.html', shows=data)
+  data, next_cursor = show_page(request.args.get('after'))
+  return render_template('pages/shows.html', shows=data, next_cursor=next_cursor)
+
+def show_page(cursor=None):
+  '''Return (shows, cursor of the next page or None).'''
+  # Only the columns a show tile needs, in one joined statement. Pages are
+  # cut with a keyset on (start_time, id) so deep pages cost the same as the
+  # first one.
+  query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')) \
+    .join(Venue, Show.venue_id == Venue.id) \
+    .join(Artist, Show.artist_id == Artist.id) \
+    .filter(Show.start_time.isnot(None))
+
+  if cursor:
+    query = query.filter(tuple_(Show.start_time, Show.id) > parse_show_cursor(cursor))
+
+  shows = query.order_by(Show.start_time, Show.id).limit(SHOWS_PER_PAGE + 1).all()
+  next_cursor = None
+  if len(shows) > SHOWS_PER_PAGE:
+    shows = shows[:SHOWS_PER_PAGE]
+    next_cursor = '%s,%d' % (shows[-1].start_time.isoformat(), shows[-1].id)
+
+  data = [{
+    "venue_id": show.venue_id,
+    "venue_name": show.venue_name,
+    "artist_id": show.artist_id,
+    "artist_name": show.artist_name,
+    "artist_image_link": show.artist_image_link,
+    "start_time": show.start_time
+    } for show in shows]
+  return data, next_cursor
 
 @app.route('/shows/create')
 def create_shows():
@@ -425,24 +614,22 @@ def create_show_submission():
   form = ShowForm(request.form, meta={'csrf': False})
   if form.validate():
    try:
-     newShow = Show(
-        start_time = form.start_time.data,
-        artist_id = form.artist_id.data,
-        venue_id = form.venue_id.data
-      )
-     print(newShow)
-     db.session.add(newShow)
-     db.session.commit()
-   except Exception as e:
-     print(e)
+     created, conflicts, errors = book_shows([{
+        "start_time": form.start_time.data,
+        "artist_id": form.artist_id.data,
+        "venue_id": form.venue_id.data,
+      }])
+   except Exception:
      error = True
      db.session.rollback()
-     print(sys.exc_info())
+     app.logger.exception('Show could not be listed')
    finally:
     db.session.close()
-   if error:
+   if error or errors:
      flash('An error occurred. Show could not be listed.')
      return render_template('pages/home.html')
+   elif conflicts:
+     flash('The venue is already booked at that time. Show could not be listed.')
    else:
      flash('Show was successfully listed!')
    return render_template('pages/home.html')
@@ -453,6 +640,50 @@ def create_show_submission():
     flash('Errors ' + str(message))
   return render_template('pages/home.html')
 
+@app.route('/shows/batch', methods=['POST'])
+def create_show_batch():
+  # Tour schedules: {"shows": [{"venue_id": 1, "artist_id": 2,
+  # "start_time": "2035-05-21 21:30:00"}, ...]}. Free rows are inserted
+  # together; double-bookings and invalid rows are reported by index.
+  body = request.get_json(silent=True)
+  if not isinstance(body, dict) or not isinstance(body.get('shows'), list):
+    abort(400)
+  # A batch locks every venue it names until it commits.
+  limit = app.config.get('SHOW_BATCH_MAX_SIZE', 500)
+  if len(body['shows']) > limit:
+    return jsonify({
+      "success": False,
+      "error": 413,
+      "message": 'At most %d shows can be booked per batch.' % limit,
+    }), 413
+  try:
+    created, conflicts, errors = book_shows(body['shows'])
+  except Exception:
+    db.session.rollback()
+    raise
+  finally:
+    db.session.close()
+  status = 201 if created else 409 if conflicts else 400
+  return jsonify({
+    "success": bool(created),
+    "created": created,
+    "conflicts": [dict(conflict, start_time=conflict['start_time'].isoformat())
+                  for conflict in conflicts],
+    "errors": errors,
+  }), status
+
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<kind>.<format>')
+def export(kind, format):
+  if kind not in EXPORTS or format not in MIMETYPES:
+    abort(404)
+  return Response(
+    stream_with_context(export_lines(kind, format)),
+    mimetype=MIMETYPES[format],
+    headers={'Content-Disposition': 'attachment; filename=%s.%s' % (kind, format)})
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -462,15 +693,8 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+if app.config.get('LOG_PIPELINE', True):
+    log_pipeline.init_app(app)
 
 #----------------------------------------------------------------------------#
 # Launch.
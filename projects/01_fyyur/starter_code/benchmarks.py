@@ -0,0 +1,427 @@
+#----------------------------------------------------------------------------#
+# Benchmarks for the Fyyur endpoints.
+#
+# Every benchmark seeds a throw-away database with synthetic rows and times
+# the endpoint through the Flask test client. By default an in-memory SQLite
+# database is used; pass --database-url to run against PostgreSQL instead
+# (the tables are dropped and re-created, so never point it at real data).
+#
+#   python benchmarks.py venues --sizes 1000 10000 100000
+#   python benchmarks.py search --sizes 1000000
+#   python benchmarks.py datetime --sizes 10000
+#   python benchmarks.py import --sizes 500000
+#   python benchmarks.py api --sizes 1 10 50 --requests 1000
+#   python benchmarks.py near --sizes 1000000
+#   python benchmarks.py logging --sizes 1 10 50 --requests 2000
+#----------------------------------------------------------------------------#
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+from flask import render_template
+from flask.logging import default_handler
+
+from app import app, format_datetime
+from api import application
+from cache import fragment_cache
+from models import db, Venue, Artist, Show
+from search import reset_indexes, search_by_name
+from logpipeline import LogPipeline, log_pipeline
+import geo
+
+STATES = ['AL', 'AK', 'AZ', 'CA', 'CO', 'FL', 'GA', 'IL', 'NY', 'TX', 'WA']
+WORDS = ['musical', 'hop', 'dueling', 'pianos', 'park', 'square', 'live', 'music',
+         'coffee', 'jazz', 'cellar', 'blue', 'note', 'velvet', 'lounge', 'garden',
+         'hall', 'room', 'stage', 'house', 'barrel', 'tavern', 'club', 'station']
+BATCH_SIZE = 10000
+
+
+def reset_database():
+  db.session.remove()
+  db.drop_all()
+  db.create_all()
+  reset_indexes()
+
+
+def seed_venues(count, cities=200):
+  rows = []
+  for i in range(count):
+    city = i % cities
+    rows.append({
+      "name": "The %s %s %d" % (random.choice(WORDS).title(), random.choice(WORDS).title(), i),
+      "city": "City %d" % city,
+      "state": STATES[city % len(STATES)],
+    })
+    if len(rows) == BATCH_SIZE:
+      db.session.bulk_insert_mappings(Venue, rows)
+      rows = []
+  db.session.bulk_insert_mappings(Venue, rows)
+  db.session.commit()
+
+
+def time_request(client, url, repeat):
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    response = client.get(url)
+    timings.append(time.perf_counter() - start)
+    assert response.status_code == 200, response.status_code
+  return statistics.median(timings)
+
+
+#  Benchmarks
+#  ----------------------------------------------------------------
+
+def bench_venues(args):
+  client = app.test_client()
+  print('%10s %12s' % ('venues', 'median (ms)'))
+  for size in args.sizes or [1000, 10000, 100000]:
+    reset_database()
+    seed_venues(size)
+    elapsed = time_request(client, '/venues', args.repeat)
+    print('%10d %12.1f' % (size, elapsed * 1000))
+
+
+def ilike_search(term):
+  # The search_venues() query this benchmark is measured against: a count
+  # plus a second execution to read the rows.
+  venues = Venue.query.filter(Venue.name.ilike('%' + term + '%'))
+  return venues.count(), [(venue.id, venue.name) for venue in venues]
+
+
+def time_call(function, repeat):
+  timings = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function()
+    timings.append(time.perf_counter() - start)
+  return statistics.median(timings)
+
+
+def bench_search(args):
+  terms = ['jazz cellar', 'hop', 'velvet lounge 12', '99999']
+  print('%10s %18s %12s %12s %12s' % ('venues', 'term', 'ilike (ms)', 'index (ms)', 'matches'))
+  for size in args.sizes or [1000000]:
+    reset_database()
+    seed_venues(size)
+    build = time_call(lambda: search_by_name(Venue, 'warm up'), 1)
+    print('%10d %18s %12s %12.1f' % (size, '(index build)', '', build * 1000))
+    for term in terms:
+      ilike = time_call(lambda: ilike_search(term), args.repeat)
+      indexed = time_call(lambda: search_by_name(Venue, term), args.repeat)
+      print('%10d %18s %12.1f %12.1f %12d' % (
+        size, term, ilike * 1000, indexed * 1000, search_by_name(Venue, term)[0]))
+
+
+def legacy_format_datetime(value, format='medium'):
+  # The filter before patterns were precompiled and results cached.
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en')
+
+
+def bench_datetime(args):
+  # Shows cluster on a limited set of evening slots, as real listings do.
+  start = datetime(2030, 1, 1, 19)
+  slots = [start + timedelta(days=day, hours=hour) for day in range(365) for hour in (0, 1, 2)]
+  print('%10s %14s %14s %14s' % ('tiles', 'legacy (ms)', 'no cache (ms)', 'cached (ms)'))
+  for size in args.sizes or [10000]:
+    shows = [{
+      "venue_id": 1,
+      "venue_name": "The Musical Hop",
+      "artist_id": 1,
+      "artist_name": "Guns N Petals",
+      "artist_image_link": "https://example.com/artist.png",
+      "start_time": random.choice(slots),
+    } for _ in range(size)]
+    legacy_shows = [dict(show, start_time=str(show['start_time'])) for show in shows]
+
+    def render(filter, shows):
+      app.jinja_env.filters['datetime'] = filter
+      with app.test_request_context('/shows'):
+        render_template('pages/shows.html', shows=shows)
+
+    legacy = time_call(lambda: render(legacy_format_datetime, legacy_shows), args.repeat)
+    uncached = time_call(lambda: render(format_datetime.__wrapped__, shows), args.repeat)
+    format_datetime.cache_clear()
+    cached = time_call(lambda: render(format_datetime, shows), args.repeat)
+    app.jinja_env.filters['datetime'] = format_datetime
+    print('%10d %14.1f %14.1f %14.1f' % (size, legacy * 1000, uncached * 1000, cached * 1000))
+
+
+def bench_import(args):
+  print('%10s %10s %12s %12s' % ('shows', 'batch', 'seconds', 'shows/s'))
+  for size in args.sizes or [100000]:
+    reset_database()
+    seed_venues(1000)
+    db.session.bulk_insert_mappings(Artist, [{"name": "Artist %d" % i} for i in range(1000)])
+    db.session.commit()
+    fd, path = tempfile.mkstemp(suffix='.ndjson')
+    with os.fdopen(fd, 'w') as file:
+      start = datetime(2030, 1, 1, 19)
+      for i in range(size):
+        file.write(json.dumps({
+          "venue_id": random.randint(1, 1000),
+          "artist_id": random.randint(1, 1000),
+          "start_time": str(start + timedelta(hours=i)),
+        }) + '\n')
+    try:
+      for batch_size in (100, 1000, 10000):
+        start_time = time.perf_counter()
+        result = app.test_cli_runner().invoke(
+          args=['fyyur', 'import', 'shows', path, '--batch-size', str(batch_size)])
+        elapsed = time.perf_counter() - start_time
+        assert result.exit_code == 0, result.output
+        print('%10d %10d %12.1f %12.0f' % (size, batch_size, elapsed, size / elapsed))
+    finally:
+      os.remove(path)
+
+
+def percentile(timings, percent):
+  timings = sorted(timings)
+  return timings[int(round((len(timings) - 1) * percent / 100.0))]
+
+
+def load_sync(urls, concurrency):
+  # One thread per concurrent client, like a threaded WSGI worker.
+  def get(url):
+    start = time.perf_counter()
+    response = app.test_client().get(url)
+    assert response.status_code == 200, response.status_code
+    return time.perf_counter() - start
+
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    return list(executor.map(get, urls))
+
+
+def load_async(urls, concurrency):
+  # Concurrent clients as coroutines against the ASGI application, in
+  # process, so no server or network is part of the measurement.
+  async def get(url, semaphore):
+    messages = []
+
+    async def receive():
+      return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+      messages.append(message)
+
+    async with semaphore:
+      start = time.perf_counter()
+      await application({'type': 'http', 'method': 'GET', 'path': url, 'query_string': b''},
+                        receive, send)
+      assert messages[0]['status'] == 200, messages[0]['status']
+      return time.perf_counter() - start
+
+  async def run():
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[get(url, semaphore) for url in urls])
+
+  return asyncio.run(run())
+
+
+def bench_api(args):
+  # Worker threads need a database they can all open; an in-memory SQLite
+  # database is private to one connection.
+  if db.engine.url.drivername.startswith('sqlite') and not db.engine.url.database:
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+  # Both stacks should do the same work per request, and the per-request
+  # profiler log would drown the results.
+  fragment_cache.timeout = 0
+  app.logger.setLevel(logging.ERROR)
+
+  reset_database()
+  seed_venues(1000)
+  db.session.bulk_insert_mappings(Artist, [{"name": "Artist %d" % i} for i in range(1000)])
+  start = datetime.now() - timedelta(days=365)
+  db.session.bulk_insert_mappings(Show, [{
+    "venue_id": random.randint(1, 1000),
+    "artist_id": random.randint(1, 1000),
+    "start_time": start + timedelta(hours=i),
+  } for i in range(20000)])
+  db.session.commit()
+  db.session.remove()
+
+  endpoints = [
+    ('venues', lambda: '/venues'),
+    ('venue', lambda: '/venues/%d' % random.randint(1, 1000)),
+    ('artists', lambda: '/artists'),
+    ('artist', lambda: '/artists/%d' % random.randint(1, 1000)),
+    ('shows', lambda: '/shows'),
+  ]
+  print('%6s %8s %12s %12s %12s %12s' % (
+    'conc', 'endpoint', 'sync req/s', 'sync p99', 'async req/s', 'async p99'))
+  for concurrency in args.sizes or [1, 10, 50]:
+    for name, url in endpoints:
+      urls = [url() for _ in range(args.requests)]
+      row = []
+      for load, prefix in ((load_sync, ''), (load_async, '/api')):
+        start_time = time.perf_counter()
+        timings = load([prefix + url for url in urls], concurrency)
+        elapsed = time.perf_counter() - start_time
+        row += [len(urls) / elapsed, percentile(timings, 99) * 1000]
+      print('%6d %8s %12.0f %10.1fms %12.0f %10.1fms' % tuple([concurrency, name] + row))
+
+
+def seed_located_venues(count):
+  # Spread uniformly over the contiguous United States.
+  rows = []
+  for i in range(count):
+    latitude, longitude = random.uniform(25, 49), random.uniform(-124, -67)
+    rows.append({"name": "Venue %d" % i, "latitude": latitude, "longitude": longitude,
+                 "geohash": geo.encode(latitude, longitude)})
+    if len(rows) == BATCH_SIZE:
+      db.session.bulk_insert_mappings(Venue, rows)
+      rows = []
+  db.session.bulk_insert_mappings(Venue, rows)
+  db.session.commit()
+
+
+def bench_near(args):
+  points = [(random.uniform(30, 45), random.uniform(-120, -75)) for _ in range(20)]
+  searches = [('radius 5 km', 5), ('radius 25 km', 25), ('radius 100 km', 100), ('nearest 10', None)]
+  print('%10s %14s %12s %12s %12s' % ('venues', 'search', 'scan (ms)', 'index (ms)', 'results'))
+  for size in args.sizes or [1000000]:
+    reset_database()
+    seed_located_venues(size)
+    for name, radius in searches:
+      limit = 10 if radius is None else 100
+      def search(points):
+        return [len(geo.venues_near(latitude, longitude, radius, limit)) for latitude, longitude in points]
+      scan = float('nan')
+      if radius is not None:
+        # Every venue measured, as if the whole world were a single cell.
+        geo.MAX_CELLS, cells = 0, geo.MAX_CELLS
+        scan = time_call(lambda: search(points[:1]), 1)
+        geo.MAX_CELLS = cells
+      indexed = time_call(lambda: search(points), args.repeat) / len(points)
+      print('%10d %14s %12.1f %12.2f %12.1f' % (
+        size, name, scan * 1000, indexed * 1000, statistics.mean(search(points))))
+
+
+class SlowFile(object):
+  '''A log file on slow storage (a network volume, a busy disk): every
+  flush takes `latency` seconds.'''
+
+  def __init__(self, file, latency):
+    self.file = file
+    self.latency = latency
+
+  def flush(self):
+    self.file.flush()
+    time.sleep(self.latency)
+
+  def __getattr__(self, name):
+    return getattr(self.file, name)
+
+
+def count_records(directory, message):
+  total = 0
+  for name in os.listdir(directory):
+    with open(os.path.join(directory, name), encoding='utf-8') as file:
+      total += sum(1 for line in file if message in line)
+  return total
+
+
+def bench_logging(args):
+  # An error storm: every request logs an exception with its traceback, as
+  # the create handlers do when a commit fails. 'sync' is the previous setup,
+  # a FileHandler plus Flask's stderr handler on the request thread.
+  # --log-latency-ms emulates slow log storage.
+  latency = args.log_latency_ms / 1000.0
+  @app.route('/bench/error')
+  def bench_error():
+    try:
+      raise RuntimeError('storm')
+    except RuntimeError:
+      app.logger.exception('Could not save')
+    return ''
+
+  log_pipeline.stop()
+  app.logger.setLevel(logging.INFO)
+  stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+  try:
+    print('%6s %6s %10s %10s %10s %10s' % ('conc', 'logging', 'req/s', 'p50', 'p99', 'logged'))
+    for concurrency in args.sizes or [1, 10, 50]:
+      for name in ('sync', 'queue'):
+        directory = tempfile.mkdtemp()
+        app.config['LOG_FILE'] = os.path.join(directory, 'error.log')
+        if name == 'sync':
+          file_handler = logging.FileHandler(app.config['LOG_FILE'])
+          file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
+          file_handler.stream = SlowFile(file_handler.stream, latency)
+          app.logger.addHandler(default_handler)
+          app.logger.addHandler(file_handler)
+        else:
+          pipeline = LogPipeline(app)
+          file_handler = pipeline.listener.handlers[0]
+          file_handler.stream = SlowFile(file_handler._open(), latency)
+        start_time = time.perf_counter()
+        timings = load_sync(['/bench/error'] * args.requests, concurrency)
+        elapsed = time.perf_counter() - start_time
+        if name == 'sync':
+          app.logger.removeHandler(default_handler)
+          app.logger.removeHandler(file_handler)
+          file_handler.close()
+        else:
+          pipeline.stop()
+        print('%6d %6s %10.0f %8.2fms %8.2fms %10d' % (
+          concurrency, name, len(timings) / elapsed, percentile(timings, 50) * 1000,
+          percentile(timings, 99) * 1000, count_records(directory, 'Could not save')))
+        for file_name in os.listdir(directory):
+          os.remove(os.path.join(directory, file_name))
+        os.rmdir(directory)
+  finally:
+    sys.stderr.close()
+    sys.stderr = stderr
+
+
+BENCHMARKS = {
+  'venues': bench_venues,
+  'search': bench_search,
+  'datetime': bench_datetime,
+  'import': bench_import,
+  'api': bench_api,
+  'near': bench_near,
+  'logging': bench_logging,
+}
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark Fyyur endpoints.')
+  parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+  parser.add_argument('--database-url', default='sqlite://')
+  parser.add_argument('--sizes', type=int, nargs='+')
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--requests', type=int, default=500,
+                      help='Requests per endpoint and concurrency level (api, logging).')
+  parser.add_argument('--log-latency-ms', type=float, default=0,
+                      help='Time each log file flush takes (logging).')
+  args = parser.parse_args()
+
+  random.seed(0)
+  app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+  with app.app_context():
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+  main()
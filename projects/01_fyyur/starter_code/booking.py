@@ -0,0 +1,197 @@
+#----------------------------------------------------------------------------#
+# Show booking with double-booking detection.
+#
+# A venue hosts one show at a time: a show occupies its venue for
+# SHOW_SLOT_MINUTES from its start, so two shows at the same venue conflict
+# when their starts are less than one slot apart. book_shows() checks a
+# whole batch against the existing shows in one query (served by the
+# (venue_id, start_time) index), checks the batch against itself, and
+# inserts every row that is free with one statement, in a single
+# transaction.
+#
+# On PostgreSQL the venues of a batch are locked (transaction-scoped
+# advisory locks) before the check, so two concurrent batches cannot both
+# book the same slot.
+#----------------------------------------------------------------------------#
+
+from datetime import timedelta
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import and_, or_, select, text
+
+from cache import artist_key, invalidate_on_commit, venue_key
+from clock import as_utc
+from conditional import bump_versions
+from counters import adjust_counters
+from forms import ShowForm, to_formdata
+from models import db, Venue, Artist, Show
+
+# First key of the two-key advisory locks taken while booking a venue.
+BOOKING_LOCK = 1017
+# Rows per multi-row INSERT; keeps the bind parameters of one statement
+# well below PostgreSQL's limit of 65535.
+INSERT_CHUNK_SIZE = 1000
+# Batch rows per OR of overlap conditions outside PostgreSQL; SQLite parses
+# an OR chain as a tree as deep as it is long, and caps that depth at 1000.
+OVERLAP_CHUNK_SIZE = 200
+
+show = Show.__table__
+
+
+def as_id(value):
+  try:
+    return int(value)
+  except ValueError:
+    return None
+
+
+def existing_ids(connection, table, ids):
+  ids = {id for id in ids if id is not None}
+  return {row.id for row in connection.execute(
+    db.select([table.c.id]).where(table.c.id.in_(ids)))}
+
+
+def insert_returning_ids(connection, table, rows):
+  '''Insert `rows` as one multi-row statement per chunk and return their new
+  ids, in the order of `rows`.'''
+  ids = []
+  if connection.dialect.name == 'postgresql':
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+      chunk = rows[start:start + INSERT_CHUNK_SIZE]
+      # RETURNING hands back the ids of a multi-row VALUES in row order.
+      ids.extend(row[0] for row in connection.execute(
+        table.insert().values(chunk).returning(table.c.id)))
+    return ids
+  # SQLAlchemy 1.3 has no RETURNING on other databases, so the ids are
+  # assigned here, past the current maximum, and the rows go in one
+  # executemany. A concurrent writer makes the insert fail on the primary
+  # key rather than hand back the wrong ids.
+  first = (connection.execute(db.select([db.func.max(table.c.id)])).scalar() or 0) + 1
+  ids = list(range(first, first + len(rows)))
+  connection.execute(table.insert(), [dict(values, id=id) for id, values in zip(ids, rows)])
+  return ids
+
+
+def show_values(form):
+  return {
+    "venue_id": as_id(form.venue_id.data),
+    "artist_id": as_id(form.artist_id.data),
+    "start_time": as_utc(form.start_time.data),
+  }
+
+
+def slot_length():
+  return timedelta(minutes=current_app.config.get('SHOW_SLOT_MINUTES', 180))
+
+
+def lock_venues(connection, venue_ids):
+  if connection.dialect.name == 'postgresql' and venue_ids:
+    connection.execute(text(
+      'SELECT pg_advisory_xact_lock(:lock, v) FROM unnest(CAST(:ids AS integer[])) AS v ORDER BY v'),
+      lock=BOOKING_LOCK, ids=sorted(venue_ids))
+
+
+def conflicts_with_existing(connection, rows, slot):
+  '''Return {row number: id of a show it overlaps} for `rows`, a list of
+  (row number, venue id, start time).'''
+  if connection.dialect.name == 'postgresql':
+    # The batch is joined as a whole from arrays, in one query.
+    overlaps = connection.execute(text(
+      'SELECT batch.number, min(show.id) FROM unnest('
+      'CAST(:rows AS integer[]), CAST(:venue_ids AS integer[]), '
+      'CAST(:starts_after AS timestamptz[]), CAST(:starts_before AS timestamptz[])) '
+      'AS batch (number, venue_id, starts_after, starts_before) '
+      'JOIN show ON show.venue_id = batch.venue_id '
+      'AND show.start_time > batch.starts_after AND show.start_time < batch.starts_before '
+      'GROUP BY batch.number'),
+      rows=[row for row, _, _ in rows],
+      venue_ids=[venue_id for _, venue_id, _ in rows],
+      starts_after=[start_time - slot for _, _, start_time in rows],
+      starts_before=[start_time + slot for _, _, start_time in rows])
+    return dict(overlaps.fetchall())
+  # Elsewhere the shows near any row of a chunk are read with one OR of
+  # (venue, time range) conditions and matched to the rows here.
+  conflicts = {}
+  for start in range(0, len(rows), OVERLAP_CHUNK_SIZE):
+    chunk = rows[start:start + OVERLAP_CHUNK_SIZE]
+    nearby = {}
+    for id, venue_id, start_time in connection.execute(
+        select([show.c.id, show.c.venue_id, show.c.start_time]).where(or_(*[and_(
+          show.c.venue_id == venue_id,
+          show.c.start_time > start_time - slot,
+          show.c.start_time < start_time + slot) for _, venue_id, start_time in chunk]))):
+      nearby.setdefault(venue_id, []).append((id, as_utc(start_time)))
+    for row, venue_id, start_time in chunk:
+      ids = [id for id, other in nearby.get(venue_id, ()) if abs(other - start_time) < slot]
+      if ids:
+        conflicts[row] = min(ids)
+  return conflicts
+
+
+def conflicts_within(rows, slot):
+  '''Return {row number: earlier row number it overlaps} for rows of the
+  same batch; the earlier row keeps the slot.'''
+  conflicts = {}
+  key = lambda row: (row[1], row[2], row[0])
+  for _, venue_rows in groupby(sorted(rows, key=key), key=lambda row: row[1]):
+    kept = None
+    for row, _, start_time in venue_rows:
+      if kept is not None and start_time - kept[1] < slot:
+        conflicts[row] = kept[0]
+      else:
+        kept = (row, start_time)
+  return conflicts
+
+
+def book_shows(records):
+  '''Validate, check and insert `records` (dicts with venue_id, artist_id and
+  start_time). Returns (created show ids, conflicts, errors); conflicts and
+  errors are lists of dicts that name the offending row by its index.'''
+  errors = []
+  valid = []
+  form = ShowForm(meta={'csrf': False})
+  for row, record in enumerate(records):
+    form.process(to_formdata(record if isinstance(record, dict) else {}))
+    if form.validate():
+      valid.append((row, show_values(form)))
+    else:
+      errors.append({"row": row, "errors": form.errors})
+
+  slot = slot_length()
+  connection = db.session.connection()
+  lock_venues(connection, {values['venue_id'] for _, values in valid if values['venue_id']})
+  venue_ids = existing_ids(connection, Venue.__table__, [values['venue_id'] for _, values in valid])
+  artist_ids = existing_ids(connection, Artist.__table__, [values['artist_id'] for _, values in valid])
+  rows = []
+  for row, values in valid:
+    if values['venue_id'] in venue_ids and values['artist_id'] in artist_ids:
+      rows.append((row, values['venue_id'], values['start_time']))
+    else:
+      errors.append({"row": row, "errors": {"venue_id": ["Unknown venue or artist."]}})
+
+  conflicts = []
+  existing = conflicts_with_existing(connection, rows, slot) if rows else {}
+  within = conflicts_within([row for row in rows if row[0] not in existing], slot)
+  for row, venue_id, start_time in rows:
+    if row in existing:
+      conflicts.append({"row": row, "venue_id": venue_id, "start_time": start_time,
+                        "show_id": existing[row]})
+    elif row in within:
+      conflicts.append({"row": row, "venue_id": venue_id, "start_time": start_time,
+                        "batch_row": within[row]})
+
+  # One multi-row insert, counted once, rather than a flush that fires the
+  # counter listeners for every show.
+  values = dict(valid)
+  booked = [values[row] for row, _, _ in rows if row not in existing and row not in within]
+  created = insert_returning_ids(connection, show, booked) if booked else []
+  if booked:
+    adjust_counters(connection, [(booking['venue_id'], booking['artist_id'], booking['start_time'])
+                                 for booking in booked])
+    bump_versions(connection, ['show', 'venue', 'artist'])
+    invalidate_on_commit(db.session, {venue_key(booking['venue_id']) for booking in booked} |
+                         {artist_key(booking['artist_id']) for booking in booked})
+  db.session.commit()
+  errors.sort(key=lambda error: error["row"])
+  return created, conflicts, errors
@@ -0,0 +1,185 @@
+#----------------------------------------------------------------------------#
+# Rendered-fragment cache for the venue and artist detail pages.
+#
+# The detail pages cache the HTML of their content block (plus the page
+# title) under the entity id ('venue:<id>', 'artist:<id>'); the page shell,
+# which carries flashed messages, is still rendered per request. Entries are
+# dropped when a commit touches the venue, the artist or one of their shows,
+# and expire no later than the start of the next upcoming show, when that
+# show turns into a past one.
+#
+# The default backend is an in-process LRU. Setting FRAGMENT_CACHE_REDIS_URL
+# switches to Redis; any client with the redis-py get/set/delete API can be
+# passed in instead, e.g. a local stand-in during development.
+#----------------------------------------------------------------------------#
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+
+from clock import as_utc, utcnow
+from models import db, Venue, Artist, Show
+
+
+def venue_key(venue_id):
+  return 'venue:%d' % int(venue_id)
+
+
+def artist_key(artist_id):
+  return 'artist:%d' % int(artist_id)
+
+
+class LRUCache(object):
+  '''Bounded, thread-safe in-process backend with per-entry expiry.'''
+
+  def __init__(self, size=1024):
+    self.size = size
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      value, expires_at = entry
+      if expires_at <= time.monotonic():
+        del self.entries[key]
+        return None
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, timeout):
+    with self.lock:
+      self.entries[key] = (value, time.monotonic() + timeout)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+
+  def delete(self, *keys):
+    with self.lock:
+      for key in keys:
+        self.entries.pop(key, None)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+
+class RedisCache(object):
+  '''Backend for any client speaking the redis-py get/set/delete API.
+  Values are stored as JSON.'''
+
+  def __init__(self, client, prefix='fyyur:fragment:'):
+    self.client = client
+    self.prefix = prefix
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+    return None if value is None else json.loads(value)
+
+  def set(self, key, value, timeout):
+    self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(timeout)))
+
+  def delete(self, *keys):
+    if keys:
+      self.client.delete(*[self.prefix + key for key in keys])
+
+  def clear(self):
+    keys = list(self.client.scan_iter(self.prefix + '*'))
+    if keys:
+      self.client.delete(*keys)
+
+
+class FragmentCache(object):
+
+  def __init__(self, app=None, backend=None):
+    self.backend = backend
+    self.timeout = 300
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('FRAGMENT_CACHE_SIZE', 1024)
+    app.config.setdefault('FRAGMENT_CACHE_TIMEOUT', 300)
+    app.config.setdefault('FRAGMENT_CACHE_REDIS_URL', None)
+    self.timeout = app.config['FRAGMENT_CACHE_TIMEOUT']
+    if self.backend is None:
+      if app.config['FRAGMENT_CACHE_REDIS_URL']:
+        import redis
+        self.backend = RedisCache(redis.Redis.from_url(app.config['FRAGMENT_CACHE_REDIS_URL']))
+      else:
+        self.backend = LRUCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+  def get(self, key):
+    return self.backend.get(key)
+
+  def set(self, key, value, expires=None):
+    '''Store `value` for FRAGMENT_CACHE_TIMEOUT seconds, or only until the
+    `expires` datetime if that comes first.'''
+    timeout = self.timeout
+    if expires is not None:
+      timeout = min(timeout, (as_utc(expires) - utcnow()).total_seconds())
+    if timeout > 0:
+      self.backend.set(key, value, timeout)
+
+  def invalidate(self, *keys):
+    self.backend.delete(*keys)
+
+  def clear(self):
+    self.backend.clear()
+
+
+fragment_cache = FragmentCache()
+
+PENDING_KEYS = 'fragment_cache_pending_keys'
+
+
+# Write-through invalidation: every handler that commits a venue, an artist
+# or a show drops the fragments showing it. Artist and venue names also
+# appear on the counterpart's page, so renaming one drops those too.
+
+def affected_keys(session, instance):
+  if isinstance(instance, Show):
+    # A show that moved counts for both its old and its new venue/artist.
+    state = inspect(instance)
+    venue_ids = state.attrs.venue_id.history.sum()
+    artist_ids = state.attrs.artist_id.history.sum()
+    return {venue_key(id) for id in venue_ids if id is not None} | \
+      {artist_key(id) for id in artist_ids if id is not None}
+  if instance in session.new:
+    return set()
+  if isinstance(instance, Venue):
+    artist_ids = session.query(Show.artist_id).filter(Show.venue_id == instance.id)
+    return {venue_key(instance.id)} | {artist_key(row.artist_id) for row in artist_ids}
+  if isinstance(instance, Artist):
+    venue_ids = session.query(Show.venue_id).filter(Show.artist_id == instance.id)
+    return {artist_key(instance.id)} | {venue_key(row.venue_id) for row in venue_ids}
+  return set()
+
+
+def invalidate_on_commit(session, keys):
+  '''Drop `keys` once `session` commits, for writes that bypass the ORM.'''
+  session.info.setdefault(PENDING_KEYS, set()).update(keys)
+
+
+@event.listens_for(db.session, 'after_flush')
+def remember_keys(session, flush_context):
+  pending = session.info.setdefault(PENDING_KEYS, set())
+  for instance in session.new | session.dirty | session.deleted:
+    pending |= affected_keys(session, instance)
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_keys(session):
+  keys = session.info.pop(PENDING_KEYS, None)
+  if keys and fragment_cache.backend is not None:
+    fragment_cache.invalidate(*keys)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_keys(session):
+  session.info.pop(PENDING_KEYS, None)
@@ -0,0 +1,262 @@
+#----------------------------------------------------------------------------#
+# Command line tools, registered on the app as `flask fyyur ...`.
+#
+#   flask fyyur import venues venues.csv
+#   flask fyyur import shows shows.ndjson --batch-size 5000
+#   flask fyyur export venues --format csv --output venues.csv
+#   flask fyyur roll-counters
+#   flask fyyur geocode
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import os
+
+import click
+from flask.cli import AppGroup
+
+from forms import VenueForm, ArtistForm, ShowForm, to_formdata
+from models import db, Venue, Artist, Show, Genre, venue_genre, artist_genre
+from search import reset_indexes
+from cache import fragment_cache
+from export import EXPORTS, export_lines
+from counters import adjust_counters, rebuild_counters, roll_counters
+from conditional import bump_versions
+from geo import coordinates, geocode_venues
+from booking import existing_ids, insert_returning_ids, show_values
+
+fyyur_cli = AppGroup('fyyur', help='Manage Fyyur data.')
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+# Tables an import writes to, for the conditional GET version stamps.
+IMPORTED_TABLES = {
+  'venues': ('venue', 'genre', 'venue_genre'),
+  'artists': ('artist', 'genre', 'artist_genre'),
+  'shows': ('show', 'venue', 'artist'),
+}
+
+
+#  Reading
+#  ----------------------------------------------------------------
+
+def read_rows(path, format):
+  '''Yield (line number, row dict) one at a time, so files of any size are
+  streamed instead of loaded.'''
+  with open(path, newline='', encoding='utf-8') as file:
+    if format == 'csv':
+      reader = csv.DictReader(file)
+      for row in reader:
+        yield reader.line_num, row
+    else:
+      for line_number, line in enumerate(file, 1):
+        if line.strip():
+          yield line_number, json.loads(line)
+
+
+def validated(rows, form_class, values, errors):
+  '''Run each row through the same form the create handlers use and yield
+  (line number, values(form)) for the valid ones; invalid rows are reported
+  and skipped. One form instance is reused, binding its fields per row
+  would cost more than validating them.'''
+  form = form_class(meta={'csrf': False})
+  for line_number, row in rows:
+    form.process(to_formdata(row))
+    if form.validate():
+      yield line_number, values(form)
+    else:
+      errors.append(line_number)
+      click.echo('line %d: %s' % (line_number, form.errors), err=True)
+
+
+def batches(items, size):
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+#  Writing
+#  ----------------------------------------------------------------
+
+def venue_values(form):
+  seeking_talent = bool(form.seeking_talent.data)
+  values = {
+    "name": form.name.data,
+    "city": form.city.data,
+    "state": form.state.data,
+    "address": form.address.data,
+    "phone": form.phone.data,
+    "image_link": form.image_link.data,
+    "website": form.website.data,
+    "facebook_link": form.facebook_link.data,
+    "seeking_talent": seeking_talent,
+    "seeking_description": form.seeking_description.data if seeking_talent else '',
+  }
+  # Imported rows bypass the session, so they are located here.
+  values.update(coordinates(form.city.data, form.state.data))
+  return form.genres.data, values
+
+
+def artist_values(form):
+  seeking_venue = bool(form.seeking_venue.data)
+  return form.genres.data, {
+    "name": form.name.data,
+    "city": form.city.data,
+    "state": form.state.data,
+    "phone": form.phone.data,
+    "image_link": form.image_link.data,
+    "website": form.website.data,
+    "facebook_link": form.facebook_link.data,
+    "seeking_venue": seeking_venue,
+    "seeking_description": form.seeking_description.data if seeking_venue else '',
+  }
+
+
+def genre_ids(connection, names, known):
+  missing = [name for name in dict.fromkeys(names) if name not in known]
+  if missing:
+    genre = Genre.__table__
+    existing = connection.execute(genre.select().where(genre.c.name.in_(missing)))
+    known.update({row.name: row.id for row in existing})
+    for name in missing:
+      if name not in known:
+        known[name] = connection.execute(genre.insert(), {"name": name}).inserted_primary_key[0]
+  return known
+
+
+def insert_with_genres(connection, table, association, owner_column, batch, known_genres):
+  genre_ids(connection, [name for _, (genres, _) in batch for name in genres], known_genres)
+  owner_ids = insert_returning_ids(connection, table, [values for _, (_, values) in batch])
+  links = []
+  for owner_id, (_, (genres, _)) in zip(owner_ids, batch):
+    links.extend({owner_column: owner_id, "genre_id": known_genres[name]}
+                 for name in dict.fromkeys(genres))
+  if links:
+    connection.execute(association.insert(), links)
+
+
+def insert_shows(connection, batch, errors):
+  # Shows may only point at venues and artists that exist; checked once per
+  # batch instead of letting one bad row abort the whole batch.
+  venue_ids = existing_ids(connection, Venue.__table__, [row['venue_id'] for _, row in batch])
+  artist_ids = existing_ids(connection, Artist.__table__, [row['artist_id'] for _, row in batch])
+  rows = []
+  for line_number, row in batch:
+    if row['venue_id'] in venue_ids and row['artist_id'] in artist_ids:
+      rows.append(row)
+    else:
+      errors.append(line_number)
+      click.echo('line %d: unknown venue or artist' % line_number, err=True)
+  if not rows:
+    return 0
+
+  if connection.dialect.name == 'postgresql':
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+      writer.writerow([row['venue_id'], row['artist_id'], row['start_time'].isoformat()])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert('COPY show (venue_id, artist_id, start_time) FROM STDIN WITH CSV', buffer)
+  else:
+    connection.execute(Show.__table__.insert(), rows)
+  adjust_counters(connection, [(row['venue_id'], row['artist_id'], row['start_time']) for row in rows])
+  return len(rows)
+
+
+#  Commands
+#  ----------------------------------------------------------------
+
+@fyyur_cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson']),
+              help='File format; guessed from the extension by default.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Rows written per transaction.')
+def import_command(kind, path, format, batch_size):
+  '''Import venues, artists or shows from a CSV or NDJSON file.
+
+  Rows are validated with the same forms as the create pages. Each batch
+  is committed on its own, so an interrupted import keeps earlier batches.
+  '''
+  format = format or FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+  form_class, values = {
+    'venues': (VenueForm, venue_values),
+    'artists': (ArtistForm, artist_values),
+    'shows': (ShowForm, show_values),
+  }[kind]
+  errors = []
+  imported = 0
+  known_genres = {}
+
+  rows = validated(read_rows(path, format), form_class, values, errors)
+  for batch in batches(rows, batch_size):
+    with db.engine.begin() as connection:
+      if kind == 'venues':
+        insert_with_genres(connection, Venue.__table__, venue_genre, 'venue_id',
+                           batch, known_genres)
+        imported += len(batch)
+      elif kind == 'artists':
+        insert_with_genres(connection, Artist.__table__, artist_genre, 'artist_id',
+                           batch, known_genres)
+        imported += len(batch)
+      else:
+        imported += insert_shows(connection, batch, errors)
+      bump_versions(connection, IMPORTED_TABLES[kind])
+
+  # The rows bypassed the session, so the session-driven invalidation in
+  # search.py and cache.py did not see them.
+  reset_indexes()
+  fragment_cache.clear()
+  click.echo('Imported %d %s, skipped %d invalid rows.' % (imported, kind, len(errors)))
+
+
+@fyyur_cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson']), default='ndjson',
+              show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='File to write to; standard output by default.')
+def export_command(kind, format, output):
+  '''Export venues, artists or shows as NDJSON or CSV, streaming row by row.'''
+  for line in export_lines(kind, format):
+    output.write(line)
+
+
+@fyyur_cli.command('roll-counters')
+@click.option('--rebuild', is_flag=True,
+              help='Recount every venue and artist instead of rolling forward.')
+def roll_counters_command(rebuild):
+  '''Move shows that have started from the upcoming to the past counters.
+
+  Meant to run every few minutes from cron; the counters behind the top
+  venues/artists page lag the clock by at most that interval.
+  '''
+  with db.engine.begin() as connection:
+    if rebuild:
+      rebuild_counters(connection)
+      click.echo('Rebuilt show counters.')
+    else:
+      click.echo('Rolled %d shows from upcoming to past.' % roll_counters(connection))
+
+
+@fyyur_cli.command('geocode')
+@click.option('--all', 'everything', is_flag=True,
+              help='Locate every venue again, not only those without coordinates.')
+def geocode_command(everything):
+  '''Locate venues from the bundled gazetteer (GAZETTEER_PATH).
+
+  Runs offline. Venues whose city and state are not in the gazetteer keep
+  empty coordinates and are left out of "venues near" searches.
+  '''
+  with db.engine.begin() as connection:
+    located, missing = geocode_venues(connection, everything)
+    bump_versions(connection, ['venue'])
+  click.echo('Located %d venues, %d not found in the gazetteer.' % (located, missing))
@@ -0,0 +1,36 @@
+#----------------------------------------------------------------------------#
+# Time.
+#
+# Show times are stored in UTC (timestamptz on PostgreSQL, see
+# models.UTCDateTime) and handled as timezone-aware datetimes. Naive values,
+# e.g. from the show form or an import file, are taken to be UTC.
+#
+# request_now() is the one "now" of a request: every view that classifies
+# shows as past or upcoming compares against it, so all of a page agrees.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime, timezone
+
+from flask import g, has_request_context
+
+
+def utcnow():
+  return datetime.now(timezone.utc)
+
+
+def as_utc(value):
+  if value is None:
+    return None
+  if value.tzinfo is None:
+    return value.replace(tzinfo=timezone.utc)
+  return value.astimezone(timezone.utc)
+
+
+def request_now():
+  '''The time the current request started; the current time outside of a
+  request.'''
+  if not has_request_context():
+    return utcnow()
+  if 'now' not in g:
+    g.now = utcnow()
+  return g.now
@@ -0,0 +1,143 @@
+#----------------------------------------------------------------------------#
+# Denormalized past/upcoming show counters on venue and artist.
+#
+# venue.past_shows_count / upcoming_shows_count (and the same on artist)
+# classify each show against the watermark in counter_watermark rather than
+# against the current time: a show counts as past once its start_time is
+# before the watermark. Inserting, moving or deleting a show adjusts the
+# counters in the same flush; `flask fyyur roll-counters`, run periodically
+# (e.g. every few minutes from cron), moves the shows that started since the
+# last run from upcoming to past and advances the watermark. The counters
+# therefore lag the clock by at most the roll interval.
+#
+# `flask fyyur roll-counters --rebuild` recounts everything from the show
+# table, for after manual SQL or if the counters were ever to drift.
+#----------------------------------------------------------------------------#
+
+from collections import Counter
+from sqlalchemy import bindparam, event, func, inspect, select
+
+from clock import as_utc, utcnow
+from models import Venue, Artist, Show, CounterWatermark
+
+venue = Venue.__table__
+artist = Artist.__table__
+show = Show.__table__
+watermark = CounterWatermark.__table__
+
+OWNERS = (
+  (venue, show.c.venue_id),
+  (artist, show.c.artist_id),
+)
+
+
+def rolled_at(connection, for_update=False, for_share=False):
+  '''Return the watermark, creating it at the current time on first use.
+
+  Writers classify shows against it FOR SHARE and rolls move it FOR UPDATE
+  (on PostgreSQL), so a roll waits for the transactions that counted shows
+  against the old watermark, and they wait for it.'''
+  query = select([watermark.c.rolled_at]).where(watermark.c.id == 1)
+  if for_update:
+    query = query.with_for_update()
+  elif for_share:
+    query = query.with_for_update(read=True)
+  value = connection.execute(query).scalar()
+  if value is None:
+    value = utcnow()
+    connection.execute(watermark.insert(), {"id": 1, "rolled_at": value})
+  return value
+
+
+def update_counters(connection, table, deltas):
+  '''Apply {(owner id, 'past' | 'upcoming'): delta} to `table` with one
+  executemany.'''
+  rows = {}
+  for (owner_id, column), delta in deltas.items():
+    if delta and owner_id is not None:
+      row = rows.setdefault(owner_id, {"b_id": owner_id, "b_past": 0, "b_upcoming": 0})
+      row["b_" + column] += delta
+  if rows:
+    connection.execute(
+      table.update().where(table.c.id == bindparam('b_id')).values(
+        past_shows_count=table.c.past_shows_count + bindparam('b_past'),
+        upcoming_shows_count=table.c.upcoming_shows_count + bindparam('b_upcoming')),
+      list(rows.values()))
+
+
+def adjust_counters(connection, shows, sign=1):
+  '''Count (sign=1) or uncount (sign=-1) `shows`, an iterable of
+  (venue_id, artist_id, start_time).'''
+  shows = [row for row in shows if row[2] is not None]
+  if not shows:
+    return
+  boundary = rolled_at(connection, for_share=True)
+  venue_deltas, artist_deltas = Counter(), Counter()
+  for venue_id, artist_id, start_time in shows:
+    column = 'past' if as_utc(start_time) < boundary else 'upcoming'
+    venue_deltas[venue_id, column] += sign
+    artist_deltas[artist_id, column] += sign
+  update_counters(connection, venue, venue_deltas)
+  update_counters(connection, artist, artist_deltas)
+
+
+def roll_counters(connection, now=None):
+  '''Move the shows that started since the last roll from upcoming to past.
+  Returns the number of shows moved.'''
+  now = as_utc(now) or utcnow()
+  previous = rolled_at(connection, for_update=True)
+  if now <= previous:
+    return 0
+  moved = 0
+  for table, owner_id in OWNERS:
+    deltas = Counter()
+    for id, count in connection.execute(
+        select([owner_id, func.count()])
+        .where(show.c.start_time >= previous)
+        .where(show.c.start_time < now)
+        .group_by(owner_id)):
+      deltas[id, 'past'] += count
+      deltas[id, 'upcoming'] -= count
+      if table is venue:
+        moved += count
+    update_counters(connection, table, deltas)
+  connection.execute(watermark.update().where(watermark.c.id == 1), {"rolled_at": now})
+  return moved
+
+
+def rebuild_counters(connection, now=None):
+  '''Recount every venue and artist from the show table.'''
+  now = as_utc(now) or utcnow()
+  rolled_at(connection, for_update=True)
+  for table, owner_id in OWNERS:
+    shows = select([func.count()]).where(owner_id == table.c.id)
+    connection.execute(table.update().values(
+      past_shows_count=shows.where(show.c.start_time < now).as_scalar(),
+      upcoming_shows_count=shows.where(show.c.start_time >= now).as_scalar()))
+  connection.execute(watermark.update().where(watermark.c.id == 1), {"rolled_at": now})
+
+
+# Keep the counters in step with shows written through the ORM. Bulk writes
+# (the import command) call adjust_counters themselves.
+
+@event.listens_for(Show, 'after_insert')
+def count_show(mapper, connection, target):
+  adjust_counters(connection, [(target.venue_id, target.artist_id, target.start_time)])
+
+
+@event.listens_for(Show, 'after_delete')
+def uncount_show(mapper, connection, target):
+  adjust_counters(connection, [(target.venue_id, target.artist_id, target.start_time)], -1)
+
+
+# Show's columns are mapped with active_history, so the history holds the
+# old values of a moved show.
+
+@event.listens_for(Show, 'after_update')
+def recount_show(mapper, connection, target):
+  histories = [inspect(target).attrs[name].history for name in ('venue_id', 'artist_id', 'start_time')]
+  if not any(history.has_changes() for history in histories):
+    return
+  old = tuple((history.deleted or history.unchanged or [None])[0] for history in histories)
+  adjust_counters(connection, [old], -1)
+  adjust_counters(connection, [(target.venue_id, target.artist_id, target.start_time)])
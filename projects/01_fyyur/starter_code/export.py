@@ -0,0 +1,88 @@
+#----------------------------------------------------------------------------#
+# Streaming export of venues, artists and shows as NDJSON or CSV.
+#
+# Rows are read through a server-side cursor (yield_per) and written out
+# one line at a time, so memory use does not grow with the table size.
+# The output can be fed back into `flask fyyur import`.
+#----------------------------------------------------------------------------#
+
+import csv
+import json
+from itertools import islice
+
+from models import db, Venue, Artist, Show, Genre, venue_genre, artist_genre
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORTS = {
+  'venues': (Venue, venue_genre, 'venue_id', [
+    'id', 'name', 'city', 'state', 'address', 'phone', 'image_link', 'genres',
+    'website', 'facebook_link', 'seeking_talent', 'seeking_description']),
+  'artists': (Artist, artist_genre, 'artist_id', [
+    'id', 'name', 'city', 'state', 'phone', 'image_link', 'genres',
+    'website', 'facebook_link', 'seeking_venue', 'seeking_description']),
+  'shows': (Show, None, None, ['id', 'venue_id', 'artist_id', 'start_time']),
+}
+
+MIMETYPES = {
+  'ndjson': 'application/x-ndjson',
+  'csv': 'text/csv',
+}
+
+
+def export_records(kind):
+  '''Yield one dict per row of `kind`, in id order.'''
+  model, association, owner_column, fields = EXPORTS[kind]
+  columns = [getattr(model, field) for field in fields if field != 'genres']
+  rows = iter(db.session.query(*columns).order_by(model.id).yield_per(EXPORT_CHUNK_SIZE))
+  while True:
+    chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+    if not chunk:
+      return
+    genres = {}
+    if association is not None:
+      # One small lookup per chunk rather than one per row.
+      owner_id = association.c[owner_column]
+      for id, name in db.session.query(owner_id, Genre.name) \
+          .join(Genre, Genre.id == association.c.genre_id) \
+          .filter(owner_id.in_([row.id for row in chunk])) \
+          .order_by(owner_id, Genre.name):
+        genres.setdefault(id, []).append(name)
+    for row in chunk:
+      record = row._asdict()
+      if association is not None:
+        record['genres'] = genres.get(row.id, [])
+      if record.get('start_time') is not None:
+        record['start_time'] = record['start_time'].strftime('%Y-%m-%d %H:%M:%S')
+      yield record
+
+
+class Echo(object):
+  # csv.writer target that hands each formatted line back instead of
+  # buffering it.
+  def write(self, value):
+    return value
+
+
+def ndjson_lines(records):
+  for record in records:
+    yield json.dumps(record) + '\n'
+
+
+def csv_lines(records, fields):
+  writer = csv.writer(Echo())
+  yield writer.writerow(fields)
+  for record in records:
+    if 'genres' in record:
+      record['genres'] = ','.join(record['genres'])
+    for key, value in record.items():
+      if isinstance(value, bool):
+        record[key] = 'true' if value else 'false'
+    yield writer.writerow([record[field] for field in fields])
+
+
+def export_lines(kind, format):
+  records = export_records(kind)
+  if format == 'csv':
+    return csv_lines(records, EXPORTS[kind][3])
+  return ndjson_lines(records)
@@ -2,6 +2,7 @@ from datetime import datetime
 from flask_wtf import Form
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField 
 from wtforms.validators import DataRequired, AnyOf, URL, Regexp, Optional
+from werkzeug.datastructures import MultiDict
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -231,3 +232,20 @@ class ArtistForm(Form):
         'website', validators=[Optional(), URL()] )
 
 # TODO IMPLEMENT NEW ARTIST FORM AND NEW SHOW FORM
+
+
+def to_formdata(row):
+    # CSV cells hold genres as 'Jazz,Blues'; NDJSON may use a list. Booleans
+    # are spelled the way BooleanField reads them.
+    formdata = MultiDict()
+    for key, value in row.items():
+        if key == 'genres' and isinstance(value, str):
+            value = [genre.strip() for genre in value.split(',') if genre.strip()]
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        if isinstance(value, list):
+            for item in value:
+                formdata.add(key, item)
+        elif value is not None:
+            formdata.add(key, str(value))
+    return formdata
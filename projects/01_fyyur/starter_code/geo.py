@@ -0,0 +1,243 @@
+#----------------------------------------------------------------------------#
+# Venue coordinates and "venues near" search.
+#
+# Coordinates come from the gazetteer bundled with the app (gazetteer.csv,
+# or GAZETTEER_PATH): one row per city and state, so venues are located to
+# their city, and geocoding never leaves the machine. New and edited venues
+# are located when they are flushed, imports locate their rows as they are
+# written, and `flask fyyur geocode` fills in the rows that predate this.
+#
+# Every located venue also stores the geohash of its coordinates in
+# venue.geohash, indexed together with the coordinates. A radius search
+# covers the circle with a handful of geohash cells, reads each cell as one
+# range scan of that index, and measures the exact distance only for the
+# candidates. A plain B-tree serves this on SQLite and PostgreSQL alike.
+#----------------------------------------------------------------------------#
+
+import csv
+import heapq
+import math
+import os
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, event, inspect, or_, select
+
+from models import db, Venue
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+# Cells read per search; the precision is chosen so that the circle is
+# covered by at most this many.
+MAX_CELLS = 32
+EARTH_RADIUS_KM = 6371.0088
+HALF_CIRCUMFERENCE_KM = math.pi * EARTH_RADIUS_KM
+NEAREST_START_KM = 5.0
+GEOCODE_BATCH_SIZE = 1000
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.csv')
+
+venue = Venue.__table__
+
+
+#  Geohash
+#  ----------------------------------------------------------------
+
+def cell_size(precision):
+  '''(height, width) in degrees of a geohash cell of `precision`.'''
+  bits = 5 * precision
+  return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+  lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+  chars = []
+  bit = value = 0
+  even = True
+  while len(chars) < precision:
+    interval, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+    middle = (interval[0] + interval[1]) / 2
+    value <<= 1
+    if coordinate >= middle:
+      value |= 1
+      interval[0] = middle
+    else:
+      interval[1] = middle
+    even = not even
+    bit += 1
+    if bit == 5:
+      chars.append(BASE32[value])
+      bit = value = 0
+  return ''.join(chars)
+
+
+def prefix_range(prefix):
+  '''(low, high) such that low <= geohash < high exactly for the geohashes
+  starting with `prefix`; high is None when there is no upper bound.'''
+  stripped = prefix.rstrip(BASE32[-1])
+  if not stripped:
+    return prefix, None
+  return prefix, stripped[:-1] + BASE32[BASE32.index(stripped[-1]) + 1]
+
+
+def bounding_box(latitude, longitude, radius_km):
+  '''(lat low, lat high, lng low, lng high) around the circle; the longitude
+  bounds may extend past +-180 when the circle crosses the antimeridian.'''
+  angle = radius_km / EARTH_RADIUS_KM
+  lat_low = max(-90.0, latitude - math.degrees(angle))
+  lat_high = min(90.0, latitude + math.degrees(angle))
+  ratio = math.sin(angle) / math.cos(math.radians(latitude)) if abs(latitude) < 90 else 2
+  if lat_low <= -90 or lat_high >= 90 or angle >= math.pi / 2 or ratio >= 1:
+    lng_delta = 180.0
+  else:
+    lng_delta = math.degrees(math.asin(ratio))
+  return lat_low, lat_high, longitude - lng_delta, longitude + lng_delta
+
+
+def covering_cells(latitude, longitude, radius_km):
+  '''The geohash cells that together cover the circle, as few and as small
+  as MAX_CELLS allows. [''] means the whole world.'''
+  lat_low, lat_high, lng_low, lng_high = bounding_box(latitude, longitude, radius_km)
+  for precision in range(GEOHASH_PRECISION, 0, -1):
+    height, width = cell_size(precision)
+    rows, columns = round(180 / height), round(360 / width)
+    first_row = int((lat_low + 90) // height)
+    last_row = min(int((lat_high + 90) // height), rows - 1)
+    first_column = int((lng_low + 180) // width)
+    column_count = min(int((lng_high + 180) // width) - first_column + 1, columns)
+    if (last_row - first_row + 1) * column_count > MAX_CELLS:
+      continue
+    return sorted({
+      encode(-90 + (row + 0.5) * height, -180 + ((column % columns) + 0.5) * width, precision)
+      for row in range(first_row, last_row + 1)
+      for column in range(first_column, first_column + column_count)})
+  return ['']
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+  '''Great-circle (haversine) distance.'''
+  lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+  a = math.sin((lat2 - lat1) / 2) ** 2 \
+    + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+#  Geocoding
+#  ----------------------------------------------------------------
+
+def place_key(city, state):
+  return (city or '').strip().lower(), (state or '').strip().upper()
+
+
+@lru_cache(maxsize=4)
+def load_gazetteer(path):
+  '''{(city, state): (latitude, longitude)} from a CSV file with city, state,
+  latitude and longitude columns.'''
+  with open(path, newline='', encoding='utf-8') as file:
+    return {place_key(row['city'], row['state']): (float(row['latitude']), float(row['longitude']))
+            for row in csv.DictReader(file)}
+
+
+def coordinates(city, state):
+  '''Column values locating a venue in `city`, `state`; all None when the
+  gazetteer does not know the place.'''
+  gazetteer = load_gazetteer(current_app.config.get('GAZETTEER_PATH') or DEFAULT_GAZETTEER)
+  location = gazetteer.get(place_key(city, state))
+  if location is None:
+    return {"latitude": None, "longitude": None, "geohash": None}
+  return {"latitude": location[0], "longitude": location[1], "geohash": encode(*location)}
+
+
+def geocode_venues(connection, everything=False):
+  '''Locate the venues without coordinates (all venues with `everything`).
+  Returns (located, not found).'''
+  located = missing = 0
+  last_id = 0
+  while True:
+    query = select([venue.c.id, venue.c.city, venue.c.state]) \
+      .where(venue.c.id > last_id).order_by(venue.c.id).limit(GEOCODE_BATCH_SIZE)
+    if not everything:
+      query = query.where(venue.c.latitude.is_(None))
+    rows = connection.execute(query).fetchall()
+    if not rows:
+      return located, missing
+    last_id = rows[-1].id
+    updates = []
+    for row in rows:
+      values = coordinates(row.city, row.state)
+      if values['geohash'] is None:
+        missing += 1
+        if not everything:
+          continue
+      else:
+        located += 1
+      updates.append(dict(values, b_id=row.id))
+    if updates:
+      connection.execute(venue.update().where(venue.c.id == bindparam('b_id')), updates)
+
+
+#  Search
+#  ----------------------------------------------------------------
+
+def venues_within(latitude, longitude, radius_km, limit):
+  '''Up to `limit` (distance, row) pairs for the venues within `radius_km`,
+  nearest first.'''
+  cells = covering_cells(latitude, longitude, radius_km)
+  query = select([venue.c.id, venue.c.name, venue.c.city, venue.c.state,
+                  venue.c.latitude, venue.c.longitude]) \
+    .where(venue.c.geohash.isnot(None))
+  if cells != ['']:
+    ranges = []
+    for cell in cells:
+      low, high = prefix_range(cell)
+      ranges.append(venue.c.geohash >= low if high is None
+                    else and_(venue.c.geohash >= low, venue.c.geohash < high))
+    query = query.where(or_(*ranges))
+  # Cells reach past the circle; the box drops most of the overshoot before
+  # rows are fetched.
+  lat_low, lat_high, lng_low, lng_high = bounding_box(latitude, longitude, radius_km)
+  query = query.where(venue.c.latitude.between(lat_low, lat_high))
+  if -180 <= lng_low and lng_high <= 180:
+    query = query.where(venue.c.longitude.between(lng_low, lng_high))
+  candidates = ((distance_km(latitude, longitude, row.latitude, row.longitude), row)
+                for row in db.session.execute(query))
+  return heapq.nsmallest(limit, (candidate for candidate in candidates if candidate[0] <= radius_km),
+                         key=lambda candidate: (candidate[0], candidate[1].id))
+
+
+def venues_near(latitude, longitude, radius_km=None, limit=10):
+  '''The `limit` venues nearest to the point, within `radius_km` if given.
+  Without a radius the search widens until it has found `limit` venues.'''
+  if radius_km is None:
+    radius_km = NEAREST_START_KM
+    found = venues_within(latitude, longitude, radius_km, limit)
+    while len(found) < limit and radius_km < HALF_CIRCUMFERENCE_KM:
+      radius_km *= 4
+      found = venues_within(latitude, longitude, radius_km, limit)
+  else:
+    found = venues_within(latitude, longitude, radius_km, limit)
+  return [{
+    "id": row.id,
+    "name": row.name,
+    "city": row.city,
+    "state": row.state,
+    "latitude": row.latitude,
+    "longitude": row.longitude,
+    "distance_km": round(distance, 2),
+  } for distance, row in found]
+
+
+# Locate venues written through the ORM. Coordinates set explicitly are kept;
+# otherwise a new venue, or one that moved city, is looked up.
+
+@event.listens_for(Venue, 'before_insert')
+@event.listens_for(Venue, 'before_update')
+def locate_venue(mapper, connection, target):
+  attrs = inspect(target).attrs
+  if attrs.latitude.history.has_changes() or attrs.longitude.history.has_changes():
+    if target.latitude is None or target.longitude is None:
+      target.geohash = None
+    else:
+      target.geohash = encode(target.latitude, target.longitude)
+  elif attrs.city.history.has_changes() or attrs.state.history.has_changes():
+    for key, value in coordinates(target.city, target.state).items():
+      setattr(target, key, value)
@@ -0,0 +1,231 @@
+#----------------------------------------------------------------------------#
+# Non-blocking application logging.
+#
+# Request threads only put records on a bounded in-memory queue (a
+# QueueHandler); a single background thread (the QueueListener) writes them
+# out. It drains whatever has queued up since its last write and writes it
+# as one batch, one JSON object per line, to LOG_FILE, rotating the file at
+# LOG_MAX_BYTES and keeping LOG_BACKUP_COUNT old files. Records are also
+# echoed to stderr from the same thread.
+#
+# When the queue is full, e.g. under a storm of errors, new records are
+# dropped and counted rather than making the request wait; the count is
+# logged once the queue has room again.
+#----------------------------------------------------------------------------#
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import has_request_context, request
+from flask.logging import default_handler
+
+# Attributes every LogRecord has; anything else was passed in `extra`.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'request'}
+
+
+class JSONFormatter(logging.Formatter):
+
+  def format(self, record):
+    entry = {
+      "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+      "level": record.levelname,
+      "logger": record.name,
+      "message": record.getMessage(),
+      "where": '%s:%d' % (record.pathname, record.lineno),
+      "thread": record.threadName,
+    }
+    request_info = getattr(record, 'request', None)
+    if request_info:
+      entry["request"] = request_info
+    if record.exc_info and not record.exc_text:
+      record.exc_text = self.formatException(record.exc_info)
+    if record.exc_text:
+      entry["exception"] = record.exc_text
+    for key, value in vars(record).items():
+      if key not in RECORD_ATTRIBUTES:
+        entry[key] = value
+    return json.dumps(entry, default=str)
+
+
+class RequestQueueHandler(QueueHandler):
+  '''Enqueues records without ever blocking, together with the request they
+  were logged from.'''
+
+  def __init__(self, log_queue):
+    super().__init__(log_queue)
+    self.dropped = 0
+    self.drop_lock = threading.Lock()
+    self.exception_formatter = logging.Formatter()
+
+  def prepare(self, record):
+    # Everything that needs the logging thread's context (the request, the
+    # traceback, the arguments) is resolved here, before the hand-off.
+    record = copy.copy(record)
+    record.message = record.getMessage()
+    if record.exc_info:
+      record.exc_text = self.exception_formatter.formatException(record.exc_info)
+    if record.stack_info:
+      record.exc_text = '\n'.join(filter(None, [record.exc_text, record.stack_info]))
+    record.msg, record.args, record.exc_info, record.stack_info = record.message, None, None, None
+    if has_request_context():
+      record.request = {
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "remote_addr": request.remote_addr,
+      }
+    return record
+
+  def enqueue(self, record):
+    # Request threads enqueue concurrently; the count of dropped records is
+    # read, reset and incremented under one lock.
+    with self.drop_lock:
+      try:
+        if self.dropped:
+          dropped = logging.makeLogRecord({
+            "name": record.name, "levelno": logging.WARNING, "levelname": 'WARNING',
+            "msg": 'Log queue was full, dropped %d records' % self.dropped,
+          })
+          self.queue.put_nowait(dropped)
+          self.dropped = 0
+        self.queue.put_nowait(record)
+      except queue.Full:
+        self.dropped += 1
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+  '''RotatingFileHandler that can write many records with one write and one
+  flush.'''
+
+  def handle_batch(self, records):
+    lines = []
+    for record in records:
+      if record.levelno >= self.level and self.filter(record):
+        try:
+          lines.append(self.format(record) + self.terminator)
+        except Exception:
+          self.handleError(record)
+    if not lines:
+      return
+    data = ''.join(lines)
+    self.acquire()
+    try:
+      if self.stream is None:
+        self.stream = self._open()
+      if self.maxBytes > 0 and self.stream.tell() and \
+          self.stream.tell() + len(data.encode(self.encoding or 'utf-8')) > self.maxBytes:
+        self.doRollover()
+        # With delay=True the rollover leaves the new file unopened.
+        if self.stream is None:
+          self.stream = self._open()
+      self.stream.write(data)
+      self.stream.flush()
+    except Exception:
+      self.handleError(records[-1])
+    finally:
+      self.release()
+
+
+class BatchQueueListener(QueueListener):
+  '''QueueListener that hands handlers everything queued since its last
+  write, up to `batch_size` records, in one call.'''
+
+  def __init__(self, log_queue, *handlers, batch_size=500):
+    super().__init__(log_queue, *handlers, respect_handler_level=True)
+    self.batch_size = batch_size
+
+  def _monitor(self):
+    log_queue = self.queue
+    has_task_done = hasattr(log_queue, 'task_done')
+    stopping = False
+    while not stopping:
+      batch = []
+      record = self.dequeue(True)
+      while True:
+        if has_task_done:
+          log_queue.task_done()
+        if record is self._sentinel:
+          stopping = True
+          break
+        batch.append(record)
+        if len(batch) == self.batch_size:
+          break
+        try:
+          record = self.dequeue(False)
+        except queue.Empty:
+          break
+      if batch:
+        self.handle_batch(batch)
+
+  def handle_batch(self, records):
+    for handler in self.handlers:
+      if hasattr(handler, 'handle_batch'):
+        handler.handle_batch(records)
+      else:
+        for record in records:
+          if record.levelno >= handler.level:
+            handler.handle(record)
+
+
+class LogPipeline(object):
+
+  def __init__(self, app=None):
+    self.app = None
+    self.handler = None
+    self.listener = None
+    self.lock = threading.Lock()
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('LOG_FILE', os.environ.get('LOG_FILE', 'error.log'))
+    app.config.setdefault('LOG_LEVEL', os.environ.get('LOG_LEVEL', 'INFO'))
+    app.config.setdefault('LOG_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('LOG_BACKUP_COUNT', 5)
+    app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+    app.config.setdefault('LOG_BATCH_SIZE', 500)
+    app.extensions['log_pipeline'] = self
+
+    file_handler = BatchRotatingFileHandler(
+      app.config['LOG_FILE'], maxBytes=app.config['LOG_MAX_BYTES'],
+      backupCount=app.config['LOG_BACKUP_COUNT'], encoding='utf-8', delay=True)
+    file_handler.setFormatter(JSONFormatter())
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+
+    log_queue = queue.Queue(app.config['LOG_QUEUE_SIZE'])
+    self.app = app
+    self.handler = RequestQueueHandler(log_queue)
+    self.listener = BatchQueueListener(log_queue, file_handler, console,
+                                       batch_size=app.config['LOG_BATCH_SIZE'])
+    self.listener.start()
+    atexit.register(self.stop)
+
+    # Flask's own handler writes to stderr on the request thread; the
+    # listener's console handler replaces it.
+    app.logger.removeHandler(default_handler)
+    app.logger.addHandler(self.handler)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+
+  def stop(self):
+    '''Detach from the app, write out everything still queued and close the
+    log file.'''
+    with self.lock:
+      if self.listener is None:
+        return
+      self.app.logger.removeHandler(self.handler)
+      self.listener.stop()
+      for handler in self.listener.handlers:
+        handler.close()
+      self.listener = None
+
+
+log_pipeline = LogPipeline()
@@ -0,0 +1,93 @@
+"""move genres into a genre table with venue/artist association tables
+
+Revision ID: 8b3f6e2d4c10
+Revises: 5d1e0b7c2a91
+Create Date: 2026-10-18 11:02:47.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b3f6e2d4c10'
+down_revision = '5d1e0b7c2a91'
+branch_labels = None
+depends_on = None
+
+
+genre = sa.table('genre', sa.column('id', sa.Integer), sa.column('name', sa.String))
+
+
+def parse_genres(value):
+    # Rows were written either as 'Jazz,Rock' or as a Postgres array
+    # literal such as '{Jazz,"Rock n Roll"}'.
+    names = (value or '').strip('{}').split(',')
+    return [name.strip().strip('"') for name in names if name.strip().strip('"')]
+
+
+def upgrade():
+    op.create_table('genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('venue_genre',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id', 'genre_id')
+    )
+    op.create_index('ix_venue_genre_genre_id', 'venue_genre', ['genre_id', 'venue_id'], unique=False)
+    op.create_table('artist_genre',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['genre_id'], ['genre.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id', 'genre_id')
+    )
+    op.create_index('ix_artist_genre_genre_id', 'artist_genre', ['genre_id', 'artist_id'], unique=False)
+
+    # Backfill the association tables from the comma-joined strings.
+    connection = op.get_bind()
+    genre_ids = {}
+    for owner, association in (('venue', 'venue_genre'), ('artist', 'artist_genre')):
+        pairs = set()
+        for owner_id, value in connection.execute(sa.text('SELECT id, genres FROM %s' % owner)):
+            for name in parse_genres(value):
+                if name not in genre_ids:
+                    connection.execute(genre.insert().values(name=name))
+                    genre_ids[name] = connection.execute(
+                        sa.select([genre.c.id]).where(genre.c.name == name)).scalar()
+                pairs.add((owner_id, genre_ids[name]))
+        if pairs:
+            op.bulk_insert(
+                sa.table(association, sa.column(owner + '_id', sa.Integer), sa.column('genre_id', sa.Integer)),
+                [{owner + '_id': owner_id, 'genre_id': genre_id} for owner_id, genre_id in sorted(pairs)])
+
+    op.drop_column('venue', 'genres')
+    op.drop_column('artist', 'genres')
+
+
+def downgrade():
+    op.add_column('artist', sa.Column('genres', sa.String(length=120), nullable=True))
+    op.add_column('venue', sa.Column('genres', sa.String(length=120), nullable=True))
+
+    connection = op.get_bind()
+    for owner, association in (('venue', 'venue_genre'), ('artist', 'artist_genre')):
+        genres = {}
+        for owner_id, name in connection.execute(sa.text(
+                'SELECT a.%s_id, g.name FROM %s a JOIN genre g ON g.id = a.genre_id ORDER BY g.name'
+                % (owner, association))):
+            genres.setdefault(owner_id, []).append(name)
+        for owner_id, names in genres.items():
+            connection.execute(sa.text('UPDATE %s SET genres = :genres WHERE id = :id' % owner),
+                               genres=','.join(names), id=owner_id)
+
+    op.drop_index('ix_artist_genre_genre_id', table_name='artist_genre')
+    op.drop_table('artist_genre')
+    op.drop_index('ix_venue_genre_genre_id', table_name='venue_genre')
+    op.drop_table('venue_genre')
+    op.drop_table('genre')
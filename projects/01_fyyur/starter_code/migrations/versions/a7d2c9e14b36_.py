@@ -0,0 +1,51 @@
+"""denormalized past/upcoming show counters on venue and artist
+
+Revision ID: a7d2c9e14b36
+Revises: e41a9c7b5f23
+Create Date: 2026-10-18 15:12:31.480227
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2c9e14b36'
+down_revision = 'e41a9c7b5f23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('counter_watermark',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    for owner in ('venue', 'artist'):
+        op.add_column(owner, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(owner, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.create_index('ix_%s_upcoming_shows_count' % owner, owner, ['upcoming_shows_count', 'id'], unique=False)
+
+    # Count the existing shows against one timestamp, which becomes the
+    # first watermark, in UTC like every time the app stores.
+    connection = op.get_bind()
+    now = datetime.utcnow()
+    connection.execute(sa.text('INSERT INTO counter_watermark (id, rolled_at) VALUES (1, :now)'), now=now)
+    for owner in ('venue', 'artist'):
+        connection.execute(sa.text(
+            'UPDATE {owner} SET '
+            'past_shows_count = (SELECT count(*) FROM show WHERE show.{owner}_id = {owner}.id '
+            'AND show.start_time < :now), '
+            'upcoming_shows_count = (SELECT count(*) FROM show WHERE show.{owner}_id = {owner}.id '
+            'AND show.start_time >= :now)'.format(owner=owner)), now=now)
+
+
+def downgrade():
+    for owner in ('artist', 'venue'):
+        op.drop_index('ix_%s_upcoming_shows_count' % owner, table_name=owner)
+        op.drop_column(owner, 'upcoming_shows_count')
+        op.drop_column(owner, 'past_shows_count')
+    op.drop_table('counter_watermark')
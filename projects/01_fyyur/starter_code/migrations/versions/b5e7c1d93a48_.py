@@ -0,0 +1,31 @@
+"""venue coordinates and geohash index
+
+Revision ID: b5e7c1d93a48
+Revises: f3b8d15c60e7
+Create Date: 2026-10-18 18:06:14.517302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e7c1d93a48'
+down_revision = 'f3b8d15c60e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing venues are located afterwards with `flask fyyur geocode`.
+    op.add_column('venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index('ix_venue_geohash', 'venue', ['geohash', 'latitude', 'longitude'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venue_geohash', table_name='venue')
+    op.drop_column('venue', 'geohash')
+    op.drop_column('venue', 'longitude')
+    op.drop_column('venue', 'latitude')
@@ -0,0 +1,56 @@
+"""show times as timestamptz
+
+Revision ID: c8f4a2e61d57
+Revises: b5e7c1d93a48
+Create Date: 2026-10-18 19:02:47.310854
+
+"""
+import os
+from datetime import timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8f4a2e61d57'
+down_revision = 'b5e7c1d93a48'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [('show', 'start_time'), ('counter_watermark', 'rolled_at')]
+
+# The naive values written so far are in the clock of the server that ran
+# the app; set FYYUR_LEGACY_TIMEZONE if that was not UTC, and run
+# `flask fyyur roll-counters --rebuild` afterwards, since the first counter
+# watermark (a7d2c9e14b36) was already stamped in UTC.
+LEGACY_TIMEZONE = os.environ.get('FYYUR_LEGACY_TIMEZONE', 'UTC')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, column in COLUMNS:
+            op.alter_column(table, column, type_=sa.DateTime(timezone=True),
+                            postgresql_using="%s AT TIME ZONE '%s'" % (column, LEGACY_TIMEZONE))
+        return
+    # Other databases keep naive UTC in the same column type, so the values
+    # are converted in place.
+    if LEGACY_TIMEZONE == 'UTC':
+        return
+    from zoneinfo import ZoneInfo
+    legacy = ZoneInfo(LEGACY_TIMEZONE)
+    connection = op.get_bind()
+    for table, column in COLUMNS:
+        rows = sa.table(table, sa.column('id', sa.Integer()), sa.column(column, sa.DateTime()))
+        for id, value in connection.execute(
+                sa.select([rows.c.id, rows.c[column]]).where(rows.c[column].isnot(None))).fetchall():
+            utc = value.replace(tzinfo=legacy).astimezone(timezone.utc).replace(tzinfo=None)
+            connection.execute(rows.update().where(rows.c.id == id).values({column: utc}))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, column in COLUMNS:
+        op.alter_column(table, column, type_=sa.DateTime(),
+                        postgresql_using="%s AT TIME ZONE 'UTC'" % column)
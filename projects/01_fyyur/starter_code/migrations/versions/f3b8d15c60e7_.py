@@ -0,0 +1,35 @@
+"""per-table version stamps for conditional GET
+
+Revision ID: f3b8d15c60e7
+Revises: a7d2c9e14b36
+Create Date: 2026-10-18 17:41:52.903114
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d15c60e7'
+down_revision = 'a7d2c9e14b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_version = op.create_table('table_version',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    now = datetime.utcnow().replace(microsecond=0)
+    op.bulk_insert(table_version, [
+        {'name': name, 'version': 1, 'changed_at': now}
+        for name in ('venue', 'artist', 'show', 'genre', 'venue_genre', 'artist_genre')])
+
+
+def downgrade():
+    op.drop_table('table_version')
@@ -1,9 +1,68 @@
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, noload, selectinload
 
-db = SQLAlchemy()
+from clock import as_utc
+from dbpool import PooledSQLAlchemy
+
+db = PooledSQLAlchemy()
+
+class UTCDateTime(db.TypeDecorator):
+    '''timestamptz on PostgreSQL, naive UTC on other databases; an aware UTC
+    datetime in Python either way.'''
+    impl = db.DateTime
+
+    def __init__(self):
+        super().__init__(timezone=True)
+
+    def process_bind_param(self, value, dialect):
+        value = as_utc(value)
+        if value is not None and dialect.name != 'postgresql':
+            value = value.replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        return as_utc(value)
+
+# Genres are stored once in `genre` and linked through association tables.
+# The (genre_id, ...) indexes answer "everything in this genre" without
+# touching the venue or artist rows of other genres.
+venue_genre = db.Table('venue_genre',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_venue_genre_genre_id', 'genre_id', 'venue_id'),
+)
+
+artist_genre = db.Table('artist_genre',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_artist_genre_genre_id', 'genre_id', 'artist_id'),
+)
+
+class Genre(db.Model):
+    __tablename__ = 'genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    @classmethod
+    def get_or_create(cls, names):
+        '''The Genre rows for `names`, adding the ones that do not exist yet.'''
+        names = list(dict.fromkeys(names))
+        genres = {genre.name: genre for genre in cls.query.filter(cls.name.in_(names))}
+        for name in names:
+            if name not in genres:
+                genres[name] = cls(name=name)
+                db.session.add(genres[name])
+        return [genres[name] for name in names]
 
 class Venue(db.Model):
     __tablename__ = 'venue'
+    __table_args__ = (
+        db.Index('ix_venue_name_trgm', 'name',
+                 postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venue_upcoming_shows_count', 'upcoming_shows_count', 'id'),
+        db.Index('ix_venue_geohash', 'geohash', 'latitude', 'longitude'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -12,39 +71,102 @@ class Venue(db.Model):
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
-    genres = db.Column(db.String)
+    genres = db.relationship(Genre, secondary=venue_genre, order_by=Genre.name)
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(120))
     facebook_link = db.Column(db.String(120))
+    # Maintained by counters.py, do not write directly.
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Located from the gazetteer by geo.py.
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
 class Artist(db.Model):
     __tablename__ = 'artist'
+    __table_args__ = (
+        db.Index('ix_artist_name_trgm', 'name',
+                 postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_artist_upcoming_shows_count', 'upcoming_shows_count', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String)
+    genres = db.relationship(Genre, secondary=artist_genre, order_by=Genre.name)
     website = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
+    # Maintained by counters.py, do not write directly.
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
 class Show(db.Model):
     __tablename__ = 'show'
+    # The detail pages read a venue's or an artist's shows in start_time
+    # order; these indexes serve both the filter and the sort.
+    __table_args__ = (
+        db.Index('ix_show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_show_artist_id_start_time', 'artist_id', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime())
-    artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'))
-    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'))
+    # active_history: moving a show has to uncount it where it was (see
+    # counters.py), so the old value is loaded before it is overwritten.
+    start_time = db.column_property(db.Column(UTCDateTime()), active_history=True)
+    artist_id = db.column_property(db.Column(db.Integer, db.ForeignKey('artist.id')), active_history=True)
+    venue_id = db.column_property(db.Column(db.Integer, db.ForeignKey('venue.id')), active_history=True)
 
     artist = db.relationship(
         Artist,
-        backref=db.backref('shows', cascade='all, delete', lazy='joined')
+        backref=db.backref('shows', cascade='all, delete')
     )
     venue = db.relationship(
         Venue,
-        backref=db.backref('shows', cascade='all, delete', lazy='joined')
-    )
\ No newline at end of file
+        backref=db.backref('shows', cascade='all, delete')
+    )
+
+class CounterWatermark(db.Model):
+    '''Single row: shows starting before `rolled_at` are counted as past in
+    the venue and artist show counters, see counters.py.'''
+    __tablename__ = 'counter_watermark'
+
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_at = db.Column(UTCDateTime(), nullable=False)
+
+class TableVersion(db.Model):
+    '''A version stamp per table, bumped in every transaction that writes to
+    it. The read views derive their ETag and Last-Modified from it, see
+    conditional.py.'''
+    __tablename__ = 'table_version'
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime(), nullable=False)
+
+# Relationships are lazy by default; each query picks how (and whether) to
+# load them, e.g. Artist.query.options(*loading(Artist)) for a plain listing
+# or Show.query.options(*loading(Show, artist='joined')) for show tiles.
+LOADING_STRATEGIES = {
+    'noload': noload,
+    'selectin': selectinload,
+    'joined': joinedload,
+}
+
+def loading(model, default='noload', **strategies):
+    '''Loader options for every relationship of `model`.
+
+    Relationships named in `strategies` use that strategy, all others use
+    `default`. Do not noload `shows` on objects that are about to be
+    deleted, the delete cascade only sees loaded shows.
+    '''
+    options = []
+    for relationship in inspect(model).relationships:
+        strategy = strategies.get(relationship.key, default)
+        options.append(LOADING_STRATEGIES[strategy](getattr(model, relationship.key)))
+    return options
\ No newline at end of file
@@ -0,0 +1,157 @@
+#----------------------------------------------------------------------------#
+# Venue and artist name search.
+#
+# On PostgreSQL searches are answered from the pg_trgm GIN indexes on
+# venue.name and artist.name (migration 5d1e0b7c2a91). Other databases
+# (SQLite in development and in the tests) use an in-process trigram index
+# that is built from the table on first use and kept current from committed
+# session changes. Both return matches ranked best first together with the
+# total number of matches, in one round trip.
+#----------------------------------------------------------------------------#
+
+import heapq
+import threading
+
+from sqlalchemy import event, func
+
+from models import db, Venue, Artist
+
+SEARCH_RESULTS_LIMIT = 50
+
+
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigrams(text):
+  return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex(object):
+  '''Substring index over the `name` column of one model.
+
+  Posting lists are append-only: renamed and deleted rows leave stale ids
+  behind, which are filtered out when candidates are checked against the
+  current name.
+  '''
+
+  def __init__(self, model):
+    self.model = model
+    self.names = None
+    self.postings = {}
+    self.lock = threading.Lock()
+
+  def ensure_built(self):
+    with self.lock:
+      if self.names is None:
+        self.names = {}
+        self.postings = {}
+        for row in db.session.query(self.model.id, self.model.name).yield_per(10000):
+          self._add(row.id, row.name)
+
+  def clear(self):
+    with self.lock:
+      self.names = None
+      self.postings = {}
+
+  def _add(self, id, name):
+    lowered = (name or '').lower()
+    previous = self.names.get(id)
+    self.names[id] = (lowered, name)
+    if previous is not None and previous[0] == lowered:
+      return
+    for trigram in trigrams(lowered):
+      self.postings.setdefault(trigram, []).append(id)
+
+  def add(self, id, name):
+    with self.lock:
+      if self.names is not None:
+        self._add(id, name)
+
+  def remove(self, id):
+    with self.lock:
+      if self.names is not None:
+        self.names.pop(id, None)
+
+  def candidates(self, term):
+    if len(term) < 3:
+      return self.names.keys()
+    postings = sorted((self.postings.get(trigram, []) for trigram in trigrams(term)), key=len)
+    ids = set(postings[0])
+    for posting in postings[1:]:
+      if not ids:
+        break
+      ids.intersection_update(posting)
+    return ids
+
+  def search(self, term, limit):
+    self.ensure_built()
+    term = term.lower()
+    with self.lock:
+      # Names that start with the term rank first, then earlier and closer
+      # (shorter) matches.
+      matches = []
+      for id in self.candidates(term):
+        entry = self.names.get(id)
+        if entry is None:
+          continue
+        position = entry[0].find(term)
+        if position >= 0:
+          matches.append((position, len(entry[0]), id, entry[1]))
+    best = heapq.nsmallest(limit, matches)
+    return len(matches), [(id, name) for _, _, id, name in best]
+
+
+INDEXES = {
+  Venue: TrigramIndex(Venue),
+  Artist: TrigramIndex(Artist),
+}
+
+PENDING_CHANGES = 'search_pending_changes'
+
+
+def search_by_name(model, term, limit=SEARCH_RESULTS_LIMIT):
+  '''Return (count, [(id, name), ...]) of the rows whose name contains
+  `term`, ignoring case, best matches first.'''
+  if db.engine.dialect.name == 'postgresql':
+    rows = db.session.query(model.id, model.name, func.count().over().label('total')) \
+      .filter(model.name.ilike('%' + escape_like(term) + '%', escape='\\')) \
+      .order_by(func.similarity(model.name, term).desc(), model.id) \
+      .limit(limit).all()
+    return (rows[0].total if rows else 0), [(row.id, row.name) for row in rows]
+  return INDEXES[model].search(term, limit)
+
+
+def reset_indexes():
+  '''Forget the in-process indexes, e.g. after the tables were rebuilt
+  outside of the session. They are rebuilt on the next search.'''
+  for index in INDEXES.values():
+    index.clear()
+
+
+# Keep the in-process indexes in step with committed changes only, so a
+# rolled back insert never shows up in search results.
+
+@event.listens_for(db.session, 'after_flush')
+def remember_changes(session, flush_context):
+  pending = session.info.setdefault(PENDING_CHANGES, [])
+  for instance in session.new | session.dirty:
+    if type(instance) in INDEXES:
+      pending.append((type(instance), instance.id, instance.name or ''))
+  for instance in session.deleted:
+    if type(instance) in INDEXES:
+      pending.append((type(instance), instance.id, None))
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_changes(session):
+  for model, id, name in session.info.pop(PENDING_CHANGES, []):
+    if name is None:
+      INDEXES[model].remove(id)
+    else:
+      INDEXES[model].add(id, name)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changes(session):
+  session.info.pop(PENDING_CHANGES, None)
@@ -0,0 +1,769 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask, g
+from sqlalchemy import event, exc
+
+# Test runs log through Flask's default handler rather than into error.log.
+os.environ.setdefault('LOG_PIPELINE', '0')
+
+from app import app, show_counts, format_datetime, venue_detail
+from counters import roll_counters
+from api import application
+from models import db, loading, Venue, Artist, Show, Genre
+from search import reset_indexes, search_by_name
+from cache import fragment_cache, LRUCache, venue_key
+from geo import covering_cells, distance_km, encode
+from logpipeline import LogPipeline, RequestQueueHandler
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and seed an in-memory database."""
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['TESTING'] = True
+        self.client = app.test_client
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        reset_indexes()
+        fragment_cache.clear()
+
+        jazz, rock = Genre(name='Jazz'), Genre(name='Rock')
+        venues = [Venue(name='Venue %d' % i, city='City %d' % (i % 2), state='CA', genres=[jazz, rock])
+                  for i in range(3)]
+        artists = [Artist(name='Artist %d' % i, city='City', state='CA', genres=[jazz])
+                   for i in range(3)]
+        db.session.add_all(venues + artists)
+        db.session.flush()
+        now = datetime.now()
+        for i in range(12):
+            db.session.add(Show(
+                venue_id=venues[i % 3].id,
+                artist_id=artists[i % 3].id,
+                start_time=now + timedelta(days=30 * (i - 6))))
+        db.session.commit()
+        self.venue_id = venues[0].id
+        self.artist_id = artists[0].id
+
+    def tearDown(self):
+        """Executed after each test"""
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def count_statements(self, url=None, callback=None):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = db.get_engine()
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            if url is None:
+                callback()
+            else:
+                res = self.client().get(url)
+                self.assertEqual(res.status_code, 200)
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        return len(statements)
+
+# Statements per endpoint (the first one reads the table version stamps)
+    def test_venues_statement_count(self):
+        self.assertEqual(self.count_statements('/venues'), 2)
+
+    def test_artists_statement_count(self):
+        self.assertEqual(self.count_statements('/artists'), 2)
+
+    def test_shows_statement_count(self):
+        self.assertEqual(self.count_statements('/shows'), 2)
+
+    def test_show_venue_statement_count(self):
+        # stamps, venue, its shows classified as past/upcoming
+        self.assertEqual(self.count_statements('/venues/%d' % self.venue_id), 3)
+
+    def test_show_artist_statement_count(self):
+        # stamps, artist, its shows classified as past/upcoming
+        self.assertEqual(self.count_statements('/artists/%d' % self.artist_id), 3)
+
+# Clock
+    def test_show_times_are_stored_in_utc(self):
+        paris = timezone(timedelta(hours=2))
+        show = Show(venue_id=self.venue_id, artist_id=self.artist_id,
+                    start_time=datetime(2035, 5, 21, 21, 30, tzinfo=paris))
+        naive = Show(venue_id=self.venue_id, artist_id=self.artist_id, start_time=datetime(2035, 5, 22, 19, 30))
+        db.session.add_all([show, naive])
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual(show.start_time, datetime(2035, 5, 21, 19, 30, tzinfo=timezone.utc))
+        self.assertEqual(naive.start_time.utcoffset(), timedelta(0))
+        self.assertEqual(naive.start_time.hour, 19)
+
+    def test_shows_are_classified_against_request_time(self):
+        now = datetime(2040, 1, 1, 20, tzinfo=timezone.utc)
+        db.session.add_all([Show(venue_id=self.venue_id, artist_id=self.artist_id, start_time=start_time)
+                            for start_time in (now - timedelta(seconds=1), now)])
+        db.session.commit()
+        with app.test_request_context('/venues/%d' % self.venue_id):
+            g.now = now
+            data = venue_detail(self.venue_id)
+        self.assertEqual(data['past_shows'][-1]['start_time'], now - timedelta(seconds=1))
+        self.assertEqual(data['upcoming_shows'][0]['start_time'], now)
+        self.assertEqual(data['upcoming_shows_count'], 1)
+        self.assertEqual(data['past_shows_count'], len(data['past_shows']))
+
+# Genres
+    def test_show_genre(self):
+        res = self.client().get('/genres/Rock')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data.count(b'href="/venues/'), 3)
+        self.assertEqual(res.data.count(b'href="/artists/'), 0)
+
+    def test_404_show_unknown_genre(self):
+        res = self.client().get('/genres/Polka')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_genre_get_or_create(self):
+        genres = Genre.get_or_create(['Jazz', 'Soul', 'Jazz'])
+
+        self.assertEqual([genre.name for genre in genres], ['Jazz', 'Soul'])
+        self.assertEqual(Genre.query.count(), 3)
+
+# Filters
+    def test_format_datetime(self):
+        start_time = datetime(2030, 5, 3, 20, 0)
+
+        self.assertEqual(format_datetime(start_time, 'full'), 'Friday May, 3, 2030 at 8:00PM')
+        self.assertEqual(format_datetime(str(start_time), 'full'), 'Friday May, 3, 2030 at 8:00PM')
+        self.assertEqual(format_datetime(start_time, 'yyyy-MM-dd'), '2030-05-03')
+
+# Bulk import
+    def write_file(self, suffix, content):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_venues_from_csv(self):
+        path = self.write_file('.csv', (
+            'name,city,state,address,phone,image_link,genres,facebook_link,website,seeking_talent\n'
+            'The Dueling Pianos Bar,New York,NY,335 Delancey Street,914-003-1132,'
+            'https://example.com/a.png,"Classical,Jazz",https://facebook.com/a,https://example.com,true\n'
+            'Broken Row,New York,XX,1 Street,123,not-a-url,Jazz,,,false\n'))
+        res = app.test_cli_runner().invoke(args=['fyyur', 'import', 'venues', path, '--batch-size', '1'])
+
+        self.assertEqual(res.exit_code, 0, res.output)
+        self.assertIn('Imported 1 venues, skipped 1 invalid rows.', res.output)
+        venue = Venue.query.filter_by(name='The Dueling Pianos Bar').one()
+        self.assertEqual([genre.name for genre in venue.genres], ['Classical', 'Jazz'])
+        self.assertTrue(venue.seeking_talent)
+        self.assertEqual(Genre.query.filter_by(name='Jazz').count(), 1)
+        self.assertEqual((venue.latitude, venue.longitude), (40.7128, -74.0060))
+
+    def test_import_artists_in_one_batch_links_each_row(self):
+        rows = [{'name': 'Batch Artist %d' % i, 'city': 'New York', 'state': 'NY',
+                 'phone': '123-123-1234', 'image_link': 'https://example.com/a.png',
+                 'genres': [genre]}
+                for i, genre in enumerate(['Jazz', 'Blues', 'Folk'])]
+        path = self.write_file('.ndjson', '\n'.join(json.dumps(row) for row in rows))
+        res = app.test_cli_runner().invoke(args=['fyyur', 'import', 'artists', path])
+
+        self.assertEqual(res.exit_code, 0, res.output)
+        self.assertIn('Imported 3 artists, skipped 0 invalid rows.', res.output)
+        for i, genre in enumerate(['Jazz', 'Blues', 'Folk']):
+            artist = Artist.query.filter_by(name='Batch Artist %d' % i).one()
+            self.assertEqual([g.name for g in artist.genres], [genre])
+
+    def test_import_shows_from_ndjson(self):
+        rows = [{'venue_id': self.venue_id, 'artist_id': self.artist_id, 'start_time': '2035-05-21 21:30:00'}] * 5
+        rows.append({'venue_id': 999, 'artist_id': self.artist_id, 'start_time': '2035-05-21 21:30:00'})
+        path = self.write_file('.ndjson', '\n'.join(json.dumps(row) for row in rows))
+        res = app.test_cli_runner().invoke(args=['fyyur', 'import', 'shows', path, '--batch-size', '2'])
+
+        self.assertEqual(res.exit_code, 0, res.output)
+        self.assertIn('Imported 5 shows, skipped 1 invalid rows.', res.output)
+        self.assertEqual(Show.query.filter_by(venue_id=self.venue_id).count(), 9)
+        self.assertEqual(self.show_counters(Venue, self.venue_id), (3, 6))
+
+# Export
+    def test_export_shows_ndjson(self):
+        res = self.client().get('/export/shows.ndjson')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(sorted(rows[0]), ['artist_id', 'id', 'start_time', 'venue_id'])
+
+    def test_404_export_unknown_kind(self):
+        self.assertEqual(self.client().get('/export/genres.csv').status_code, 404)
+
+    def test_export_then_import_venues(self):
+        venue = Venue.query.get(self.venue_id)
+        venue.address, venue.phone = '1015 Folsom Street', '123-123-1234'
+        venue.image_link = venue.facebook_link = venue.website = 'https://example.com'
+        venue.genres = Genre.get_or_create(['Jazz', 'Blues'])
+        db.session.commit()
+        path = self.write_file('.csv', '')
+        runner = app.test_cli_runner()
+        res = runner.invoke(args=['fyyur', 'export', 'venues', '--format', 'csv', '--output', path])
+        self.assertEqual(res.exit_code, 0, res.output)
+
+        res = runner.invoke(args=['fyyur', 'import', 'venues', path])
+        self.assertIn('Imported 1 venues, skipped 2 invalid rows.', res.output)
+        copy = Venue.query.filter(Venue.name == 'Venue 0', Venue.id != self.venue_id).one()
+        self.assertEqual([genre.name for genre in copy.genres], ['Blues', 'Jazz'])
+
+# Query plans
+    def explain(self, statement, parameters):
+        # The captured statement is in the driver's paramstyle, so it is
+        # explained on the raw connection.
+        prefix = 'EXPLAIN ' if db.engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+        rows = db.session.connection().execute(prefix + statement, parameters)
+        return '\n'.join(str(row[-1]) for row in rows)
+
+    def assert_no_show_scan(self, url):
+        # Seed enough shows for a full scan to be clearly the wrong plan.
+        db.session.bulk_insert_mappings(Show, [{
+            'venue_id': 1000 + i % 500,
+            'artist_id': 1000 + i % 700,
+            'start_time': datetime(2030, 1, 1) + timedelta(hours=i)} for i in range(20000)])
+        db.session.commit()
+        db.session.execute('ANALYZE')
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if ' show' in statement:
+                statements.append((statement, parameters))
+
+        event.listen(db.get_engine(), 'before_cursor_execute', before_cursor_execute)
+        try:
+            self.assertEqual(self.client().get(url).status_code, 200)
+        finally:
+            event.remove(db.get_engine(), 'before_cursor_execute', before_cursor_execute)
+
+        self.assertTrue(statements)
+        for statement, parameters in statements:
+            plan = self.explain(statement, parameters)
+            self.assertNotIn('Seq Scan on show', plan, statement)
+            self.assertNotRegex(plan, r'SCAN (TABLE )?show\b', statement)
+
+    def test_show_venue_uses_show_index(self):
+        self.assert_no_show_scan('/venues/%d' % self.venue_id)
+
+    def test_show_artist_uses_show_index(self):
+        self.assert_no_show_scan('/artists/%d' % self.artist_id)
+
+# Connection pool
+    def test_metrics_endpoint(self):
+        app.config['METRICS_TOKEN'] = 'metrics-token'
+        self.addCleanup(app.config.update, METRICS_TOKEN=None)
+        self.assertEqual(self.client().get('/metrics').status_code, 401)
+        res = self.client().get('/metrics', headers={'Authorization': 'Bearer metrics-token'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('# TYPE db_pool_checkouts_total counter', res.get_data(as_text=True))
+
+    def test_metrics_endpoint_without_a_token(self):
+        self.assertEqual(self.client().get('/metrics').status_code, 404)
+
+    def test_pool_counts_checkouts_overflow_and_timeouts(self):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        settings = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+                    'DB_POOL_SIZE': 1, 'DB_MAX_OVERFLOW': 1, 'DB_POOL_TIMEOUT': 0.05,
+                    'METRICS_TOKEN': 'metrics-token'}
+        previous = {name: app.config[name] for name in settings}
+        app.config.update(settings)
+        self.addCleanup(app.config.update, previous)
+        metrics = db.pool_metrics
+        checkouts, overflow_checkouts, timeouts = \
+            metrics.checkouts, metrics.overflow_checkouts, metrics.timeouts
+
+        engine = db.get_engine()
+        self.addCleanup(engine.dispose)
+        with engine.connect(), engine.connect():
+            with self.assertRaises(exc.TimeoutError):
+                engine.connect()
+            text = self.client().get('/metrics', headers={
+                'Authorization': 'Bearer metrics-token'}).get_data(as_text=True)
+
+        self.assertEqual(metrics.checkouts - checkouts, 2)
+        self.assertEqual(metrics.overflow_checkouts - overflow_checkouts, 1)
+        self.assertEqual(metrics.timeouts - timeouts, 1)
+        self.assertGreaterEqual(metrics.max_wait_seconds, 0.05)
+        self.assertIn('db_pool_checked_out{pid="%d"} 2' % os.getpid(), text)
+        self.assertIn('db_pool_overflow{pid="%d"} 1' % os.getpid(), text)
+
+# SQL profiling
+    def test_server_timing_header_counts_queries(self):
+        res = self.client().get('/venues/%d' % self.venue_id)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertRegex(res.headers['Server-Timing'], r'^db;desc="3 queries";dur=[0-9.]+$')
+
+    def test_slow_queries_are_logged_with_endpoint(self):
+        app.config['SQL_SLOW_QUERY_MS'] = 0
+        self.addCleanup(app.config.update, SQL_SLOW_QUERY_MS=100)
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            self.client().get('/venues')
+
+        self.assertEqual(len(logs.output), 2)
+        for output in logs.output:
+            self.assertIn('Slow query', output)
+            self.assertIn('in venues: SELECT', output)
+
+# Show counters
+    def show_counters(self, model, id):
+        return db.session.query(model.past_shows_count, model.upcoming_shows_count) \
+            .filter(model.id == id).one()
+
+    def test_show_counters_follow_inserts_and_deletes(self):
+        self.assertEqual(self.show_counters(Venue, self.venue_id), (3, 1))
+        self.assertEqual(self.show_counters(Artist, self.artist_id), (3, 1))
+
+        show = Show(venue_id=self.venue_id, artist_id=self.artist_id,
+                    start_time=datetime.now() + timedelta(days=1))
+        db.session.add(show)
+        db.session.commit()
+        self.assertEqual(self.show_counters(Venue, self.venue_id), (3, 2))
+        self.assertEqual(self.show_counters(Artist, self.artist_id), (3, 2))
+
+        show.start_time = datetime(2000, 1, 1)
+        db.session.commit()
+        self.assertEqual(self.show_counters(Venue, self.venue_id), (4, 1))
+
+        db.session.delete(show)
+        db.session.commit()
+        self.assertEqual(self.show_counters(Venue, self.venue_id), (3, 1))
+
+    def test_roll_counters_moves_started_shows(self):
+        later = datetime.now() + timedelta(days=100)
+        with db.engine.begin() as connection:
+            self.assertEqual(roll_counters(connection, later), 3)
+            self.assertEqual(roll_counters(connection, later), 0)
+
+        for id in Venue.query.with_entities(Venue.id):
+            self.assertEqual(tuple(self.show_counters(Venue, id.id)),
+                             tuple(db.session.query(*show_counts(later))
+                                   .filter(Show.venue_id == id.id).one()))
+
+    def test_rebuild_counters_command(self):
+        Venue.query.update({'past_shows_count': 42, 'upcoming_shows_count': 42})
+        db.session.commit()
+        res = app.test_cli_runner().invoke(args=['fyyur', 'roll-counters', '--rebuild'])
+
+        self.assertEqual(res.exit_code, 0, res.output)
+        self.assertEqual(self.show_counters(Venue, self.venue_id), (3, 1))
+
+    def test_top(self):
+        res = self.client().get('/top')
+        html = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLess(html.index('Venue 2'), html.index('Venue 1'))
+        self.assertLess(html.index('Venue 1'), html.index('Venue 0'))
+        self.assertEqual(self.count_statements('/top'), 2)
+
+# JSON API
+    def call_api(self, path, method='GET'):
+        path, _, query_string = path.partition('?')
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': query_string.encode('ascii')}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(application(scope, receive, send))
+        return messages[0]['status'], json.loads(messages[1]['body'])
+
+    def test_api_venues(self):
+        status, body = self.call_api('/api/venues')
+
+        self.assertEqual(status, 200)
+        self.assertEqual([area['city'] for area in body['data']['areas']], ['City 0', 'City 1'])
+
+    def test_api_venue_matches_page_data(self):
+        status, body = self.call_api('/api/venues/%d' % self.venue_id)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body['data']['name'], 'Venue 0')
+        self.assertEqual(body['data']['genres'], ['Jazz', 'Rock'])
+        self.assertEqual((body['data']['past_shows_count'], body['data']['upcoming_shows_count']), (3, 1))
+        show = body['data']['upcoming_shows'][0]
+        self.assertEqual(show['artist_name'], 'Artist 0')
+        self.assertEqual(datetime.fromisoformat(show['start_time']),
+                         Show.query.filter_by(venue_id=self.venue_id).order_by(Show.start_time.desc()).first().start_time)
+
+    def test_api_artist_and_artists(self):
+        self.assertEqual(self.call_api('/api/artists')[1]['data']['artists'][0]['name'], 'Artist 0')
+        status, body = self.call_api('/api/artists/%d' % self.artist_id)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body['data']['past_shows']), 3)
+
+    def test_api_shows_pages_with_cursor(self):
+        status, body = self.call_api('/api/shows')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body['data']['shows']), 12)
+        self.assertIsNone(body['data']['next_cursor'])
+
+    def test_api_errors(self):
+        self.assertEqual(self.call_api('/api/venues/999'), (404, {
+            'success': False, 'error': 404, 'message': 'resource not found'}))
+        self.assertEqual(self.call_api('/api/shows?after=nonsense')[0], 400)
+        self.assertEqual(self.call_api('/api/venues', method='POST')[0], 405)
+        self.assertEqual(self.call_api('/api/nothing')[0], 404)
+
+# Conditional GET
+    def test_unchanged_listing_is_not_modified(self):
+        res = self.client().get('/venues')
+        etag, last_modified = res.headers['ETag'], res.headers['Last-Modified']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(etag.startswith('W/"'))
+        res = self.client().get('/venues', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        res = self.client().get('/venues', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(res.status_code, 304)
+        # Only the version stamps are read.
+        self.assertEqual(self.count_statements(
+            callback=lambda: self.client().get('/venues', headers={'If-None-Match': etag})), 1)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client().get('/shows').headers['ETag']
+        artist_etag = self.client().get('/artists').headers['ETag']
+        db.session.add(Venue(name='Another Venue', city='City 0', state='CA'))
+        db.session.commit()
+
+        res = self.client().get('/shows', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        res = self.client().get('/artists', headers={'If-None-Match': artist_etag})
+        self.assertEqual(res.status_code, 304)
+
+    def test_import_changes_the_etag(self):
+        etag = self.client().get('/venues/%d' % self.venue_id).headers['ETag']
+        path = self.write_file('.ndjson', json.dumps({
+            'venue_id': self.venue_id, 'artist_id': self.artist_id, 'start_time': '2035-05-21 21:30:00'}))
+        app.test_cli_runner().invoke(args=['fyyur', 'import', 'shows', path])
+
+        res = self.client().get('/venues/%d' % self.venue_id, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+# Batched show booking
+    def test_batch_books_free_slots_and_reports_conflicts(self):
+        taken = Show.query.filter_by(venue_id=self.venue_id).order_by(Show.start_time.desc()).first()
+        later = taken.start_time + timedelta(days=10)
+        taken_id = taken.id
+        counts = self.show_counters(Venue, self.venue_id)
+        etag = self.client().get('/shows').headers['ETag']
+        self.client().get('/venues/%d' % self.venue_id)
+        self.assertIsNotNone(fragment_cache.get(venue_key(self.venue_id)))
+
+        res = self.client().post('/shows/batch', json={'shows': [
+            {'venue_id': self.venue_id, 'artist_id': self.artist_id,
+             'start_time': (taken.start_time + timedelta(hours=1)).strftime(TIME_FORMAT)},
+            {'venue_id': self.venue_id, 'artist_id': self.artist_id,
+             'start_time': later.strftime(TIME_FORMAT)},
+            {'venue_id': self.venue_id, 'artist_id': self.artist_id,
+             'start_time': (later + timedelta(hours=2)).strftime(TIME_FORMAT)},
+            {'venue_id': self.venue_id, 'artist_id': self.artist_id,
+             'start_time': (later + timedelta(hours=3)).strftime(TIME_FORMAT)},
+            {'venue_id': self.venue_id, 'start_time': 'tomorrow-ish'},
+            {'venue_id': 9999, 'artist_id': self.artist_id, 'start_time': later.strftime(TIME_FORMAT)},
+        ]})
+        self.assertEqual(res.status_code, 201)
+        data = json.loads(res.data)
+        self.assertEqual(len(data['created']), 2)
+        self.assertEqual([(c['row'], c.get('show_id'), c.get('batch_row')) for c in data['conflicts']],
+                         [(0, taken_id, None), (2, None, 1)])
+        self.assertEqual([error['row'] for error in data['errors']], [4, 5])
+
+        self.assertEqual(Show.query.count(), 14)
+        self.assertEqual(self.show_counters(Venue, self.venue_id), (counts[0], counts[1] + 2))
+        self.assertIsNone(fragment_cache.get(venue_key(self.venue_id)))
+        res = self.client().get('/shows', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+    def test_batch_with_only_conflicts(self):
+        taken = Show.query.filter_by(venue_id=self.venue_id).first()
+        res = self.client().post('/shows/batch', json={'shows': [
+            {'venue_id': self.venue_id, 'artist_id': self.artist_id,
+             'start_time': taken.start_time.strftime(TIME_FORMAT)}]})
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(json.loads(res.data)['created'], [])
+        self.assertEqual(self.client().post('/shows/batch', json=[]).status_code, 400)
+
+    def test_413_batch_over_the_size_limit(self):
+        app.config['SHOW_BATCH_MAX_SIZE'] = 2
+        self.addCleanup(app.config.update, SHOW_BATCH_MAX_SIZE=500)
+        show = {'venue_id': self.venue_id, 'artist_id': self.artist_id,
+                'start_time': '2035-05-21 21:30:00'}
+        res = self.client().post('/shows/batch', json={'shows': [show] * 3})
+
+        self.assertEqual(res.status_code, 413)
+        self.assertEqual(json.loads(res.data)['error'], 413)
+        self.assertEqual(Show.query.count(), 12)
+
+    def test_create_show_rejects_double_booking(self):
+        taken = Show.query.filter_by(venue_id=self.venue_id).first()
+        res = self.client().post('/shows/create', data={
+            'artist_id': self.artist_id,
+            'venue_id': self.venue_id,
+            'start_time': (taken.start_time - timedelta(minutes=30)).strftime(TIME_FORMAT)})
+        self.assertIn(b'already booked', res.data)
+        self.assertEqual(Show.query.count(), 12)
+
+# Venues near
+    def add_located_venues(self):
+        for name, city, state in [('Fillmore', 'San Francisco', 'CA'), ('Fox', 'Oakland', 'CA'),
+                                  ('Greek', 'Berkeley', 'CA'), ('SAP Center', 'San Jose', 'CA'),
+                                  ('Apollo', 'New York', 'NY')]:
+            db.session.add(Venue(name=name, city=city, state=state))
+        db.session.commit()
+
+    def test_geohash(self):
+        self.assertEqual(encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        for latitude, longitude, radius in [(37.77, -122.42, 5), (-33.87, 151.21, 40),
+                                            (64.1, -179.9, 100), (0.0, 0.0, 1)]:
+            cells = covering_cells(latitude, longitude, radius)
+            self.assertLessEqual(len(cells), 32)
+            for bearing in range(0, 360, 15):
+                # A point just inside the circle, in every direction.
+                lat = latitude + (radius * 0.99 / 111.2) * math.cos(math.radians(bearing))
+                lng = longitude + (radius * 0.99 / 111.2) * math.sin(math.radians(bearing)) \
+                    / math.cos(math.radians(lat))
+                lng = (lng + 180) % 360 - 180
+                if distance_km(latitude, longitude, lat, lng) <= radius:
+                    self.assertTrue(any(encode(lat, lng).startswith(cell) for cell in cells))
+
+    def test_venues_within_radius(self):
+        self.add_located_venues()
+        status, body = self.call_api('/api/venues/near?lat=37.7749&lng=-122.4194&radius=20')
+        self.assertEqual(status, 200)
+        venues = body['data']['venues']
+        self.assertEqual([venue['name'] for venue in venues], ['Fillmore', 'Fox', 'Greek'])
+        self.assertEqual(venues[0]['distance_km'], 0)
+
+        res = self.client().get('/venues/near?lat=37.7749&lng=-122.4194&radius=20')
+        self.assertIn(b'Oakland, CA', res.data)
+        self.assertEqual(self.client().get('/venues/near?lat=91&lng=0').status_code, 400)
+        self.assertEqual(self.call_api('/api/venues/near?lat=37.7')[0], 400)
+
+    def test_nearest_venues(self):
+        self.add_located_venues()
+        status, body = self.call_api('/api/venues/near?lat=37.7749&lng=-122.4194&limit=4')
+        self.assertEqual([venue['name'] for venue in body['data']['venues']],
+                         ['Fillmore', 'Fox', 'Greek', 'SAP Center'])
+        status, body = self.call_api('/api/venues/near?lat=0&lng=0&limit=100')
+        self.assertEqual(len(body['data']['venues']), 5)
+
+    def test_venues_are_located_on_write_and_by_command(self):
+        self.add_located_venues()
+        venue = Venue.query.filter_by(name='Apollo').one()
+        venue.city, venue.state = 'Seattle', 'WA'
+        db.session.commit()
+        self.assertEqual(venue.geohash, encode(47.6062, -122.3321))
+
+        db.session.execute(Venue.__table__.insert(), {'name': 'Raw', 'city': 'Boston', 'state': 'MA'})
+        db.session.commit()
+        res = app.test_cli_runner().invoke(args=['fyyur', 'geocode'])
+        self.assertIn('Located 1 venues, 3 not found', res.output)
+        self.assertEqual(Venue.query.filter_by(name='Raw').one().latitude, 42.3601)
+
+# Logging
+    def log_app(self, **config):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        log_app = Flask('logtest')
+        log_app.config.update(LOG_FILE=os.path.join(directory, 'app.log'), **config)
+        pipeline = LogPipeline(log_app)
+        self.addCleanup(pipeline.stop)
+        return log_app, pipeline, directory
+
+    def read_log(self, path):
+        with open(path, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_log_records_are_json_with_request(self):
+        log_app, pipeline, directory = self.log_app()
+
+        @log_app.route('/fail')
+        def fail():
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                log_app.logger.exception('Could not divide %d', 1, extra={'venue_id': 7})
+            return 'ok'
+
+        log_app.test_client().get('/fail')
+        pipeline.stop()
+        entry, = self.read_log(os.path.join(directory, 'app.log'))
+        self.assertEqual(entry['level'], 'ERROR')
+        self.assertEqual(entry['message'], 'Could not divide 1')
+        self.assertEqual(entry['request']['path'], '/fail')
+        self.assertEqual(entry['venue_id'], 7)
+        self.assertIn('ZeroDivisionError', entry['exception'])
+
+    def test_log_file_is_rotated(self):
+        log_app, pipeline, directory = self.log_app(LOG_MAX_BYTES=4000, LOG_BACKUP_COUNT=2, LOG_BATCH_SIZE=10)
+        for i in range(100):
+            log_app.logger.warning('record %d', i)
+        pipeline.stop()
+        files = sorted(os.listdir(directory))
+        self.assertEqual(files, ['app.log', 'app.log.1', 'app.log.2'])
+        for name in files:
+            self.assertLessEqual(os.path.getsize(os.path.join(directory, name)), 4000)
+        messages = [entry['message'] for entry in self.read_log(os.path.join(directory, 'app.log'))]
+        self.assertEqual(messages[-1], 'record 99')
+
+    def test_full_log_queue_drops_records(self):
+        log_queue = queue.Queue(1)
+        handler = RequestQueueHandler(log_queue)
+        record = logging.makeLogRecord({'msg': 'storm', 'levelno': logging.ERROR})
+        handler.handle(record)
+        handler.handle(record)
+        self.assertEqual(handler.dropped, 1)
+        log_queue.get_nowait()
+        log_queue.maxsize = 2
+        handler.handle(record)
+        self.assertEqual([log_queue.get_nowait().msg, log_queue.get_nowait().msg],
+                         ['Log queue was full, dropped 1 records', 'storm'])
+
+    def test_drop_count_survives_concurrent_threads(self):
+        log_queue = queue.Queue(50)
+        handler = RequestQueueHandler(log_queue)
+        record = logging.makeLogRecord({'msg': 'storm', 'levelno': logging.ERROR})
+        threads = [threading.Thread(target=lambda: [handler.enqueue(record) for _ in range(500)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        queued = [log_queue.get_nowait() for _ in range(log_queue.qsize())]
+        reported = sum(int(entry.msg.split()[-2]) for entry in queued if entry.msg != 'storm')
+        stored = sum(1 for entry in queued if entry.msg == 'storm')
+        self.assertEqual(stored + reported + handler.dropped, 8 * 500)
+
+# Loading policies
+    def test_selectin_loading_policy(self):
+        def load():
+            venues = Venue.query.options(*loading(Venue, shows='selectin')).all()
+            self.assertEqual(sum(len(venue.shows) for venue in venues), 12)
+        self.assertEqual(self.count_statements(callback=load), 2)
+
+    def test_joined_loading_policy(self):
+        def load():
+            shows = Show.query.options(*loading(Show, default='joined')).all()
+            self.assertTrue(all(show.artist and show.venue for show in shows))
+        self.assertEqual(self.count_statements(callback=load), 1)
+
+# Fragment cache
+    def test_detail_pages_are_served_from_cache(self):
+        self.assertEqual(self.count_statements('/venues/%d' % self.venue_id), 3)
+        self.assertEqual(self.count_statements('/venues/%d' % self.venue_id), 1)
+        self.assertEqual(self.count_statements('/artists/%d' % self.artist_id), 3)
+        self.assertEqual(self.count_statements('/artists/%d' % self.artist_id), 1)
+
+    def test_create_show_invalidates_venue_and_artist(self):
+        artist = Artist(name='Touring Artist')
+        db.session.add(artist)
+        db.session.commit()
+        artist_id = artist.id
+        self.client().get('/venues/%d' % self.venue_id)
+        self.client().get('/artists/%d' % artist_id)
+
+        res = self.client().post('/shows/create', data={
+            'artist_id': artist_id,
+            'venue_id': self.venue_id,
+            'start_time': '2099-01-01 20:00:00'})
+        self.assertIn(b'Show was successfully listed!', res.data)
+
+        self.assertIn(b'Touring Artist', self.client().get('/venues/%d' % self.venue_id).data)
+        self.assertIn(b'1 Upcoming Show', self.client().get('/artists/%d' % artist_id).data)
+
+    def test_rename_artist_invalidates_venue(self):
+        self.client().get('/venues/%d' % self.venue_id)
+        artist = Artist.query.get(self.artist_id)
+        artist.name = 'Renamed Artist'
+        db.session.commit()
+
+        self.assertIn(b'Renamed Artist', self.client().get('/venues/%d' % self.venue_id).data)
+
+    def test_fragment_expires_at_next_show(self):
+        fragment_cache.set('venue:0', 'html', expires=datetime.now() - timedelta(seconds=1))
+        fragment_cache.set('venue:1', 'html', expires=datetime.now() + timedelta(days=1))
+
+        self.assertIsNone(fragment_cache.get('venue:0'))
+        self.assertEqual(fragment_cache.get('venue:1'), 'html')
+
+    def test_lru_cache_is_bounded(self):
+        cache = LRUCache(size=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+# Search
+    def test_search_venues(self):
+        res = self.client().post('/venues/search', data={'search_term': 'venue'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Number of search results for "venue": 3', res.data)
+
+    def test_search_ranks_prefix_matches_first(self):
+        db.session.add(Artist(name='The Artist'))
+        db.session.commit()
+        count, artists = search_by_name(Artist, 'art')
+
+        self.assertEqual(count, 4)
+        self.assertEqual([name for id, name in artists][-1], 'The Artist')
+
+    def test_search_sees_only_committed_changes(self):
+        self.assertEqual(search_by_name(Venue, 'Musical Hop')[0], 0)
+        db.session.add(Venue(name='The Musical Hop'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(search_by_name(Venue, 'Musical Hop')[0], 0)
+
+        venue = Venue(name='The Musical Hop')
+        db.session.add(venue)
+        db.session.commit()
+        self.assertEqual(search_by_name(Venue, 'musical hop'), (1, [(venue.id, 'The Musical Hop')]))
+
+        db.session.delete(venue)
+        db.session.commit()
+        self.assertEqual(search_by_name(Venue, 'Musical Hop')[0], 0)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+#----------------------------------------------------------------------------#
+# Benchmarks for the trivia API.
+#
+# Every benchmark seeds a throw-away database with synthetic rows and times
+# the endpoint through the Flask test client. By default an in-memory SQLite
+# database is used; pass --database-url to run against PostgreSQL instead
+# (the tables are dropped and re-created, so never point it at real data).
+#
+#   python benchmarks.py quiz --sizes 1000 10000 100000 --sessions 10000
+#   python benchmarks.py quiz --sizes 1000000 --pickers pool session
+#   python benchmarks.py search --sizes 1000000 --requests 200
+#----------------------------------------------------------------------------#
+
+import argparse
+import json
+import random
+import statistics
+import time
+
+from flask import request, jsonify
+
+from flaskr import create_app
+from models import db, Question, Category
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+WORDS = ['planet', 'river', 'painter', 'novel', 'element', 'capital', 'ocean', 'king',
+         'movie', 'team', 'mountain', 'war', 'composer', 'island', 'theory', 'empire',
+         'desert', 'actor', 'bridge', 'language', 'festival', 'comet', 'castle', 'volcano']
+BATCH_SIZE = 10000
+
+
+def reset_database():
+  db.session.remove()
+  db.drop_all()
+  db.create_all()
+
+
+def seed_questions(count):
+  db.session.bulk_insert_mappings(Category, [{"type": type} for type in CATEGORIES])
+  for start in range(0, count, BATCH_SIZE):
+    db.session.bulk_insert_mappings(Question, [{
+      "question": 'Which %s %s the %s? (%d)' % tuple(random.sample(WORDS, 3) + [i]),
+      "answer": '%s %s' % tuple(random.sample(WORDS, 2)),
+      "category": str(i % len(CATEGORIES) + 1),
+      "difficulty": i % 5 + 1,
+    } for i in range(start, min(start + BATCH_SIZE, count))])
+  db.session.commit()
+
+
+def legacy_play_quiz():
+  '''/quizzes as it was: every question of the category loaded, the asked
+  ones removed from a list one by one.'''
+  category = request.args.get('category')
+  previous_questions_args = request.args.get('prevQuestions', [])
+  formatted_previous_questions = previous_questions_args.split(",")
+  quiz_question = None
+  if previous_questions_args:
+    if category == '0':
+      questions = Question.query.all()
+    else:
+      questions = Question.query.filter(Question.category.in_(category)).all()
+    quiz_questions = [str(question.id) for question in questions]
+    for previous_question in formatted_previous_questions:
+      if previous_question in quiz_questions:
+        quiz_questions.remove(previous_question)
+    if quiz_questions:
+      quiz_question = Question.query.get(random.choice(list(dict.fromkeys(quiz_questions))))
+  elif category == '0':
+    quiz_question = Question.query.first()
+  else:
+    quiz_question = Question.query.filter(Question.category.in_(category)).first()
+  return jsonify({
+    'success': True,
+    'question': quiz_question.format() if quiz_question else None,
+  })
+
+
+def play_sessions(client, url, sessions, rounds):
+  '''Run `sessions` quizzes side by side, one question per session in turn,
+  `rounds` questions each. Returns the time of every request.'''
+  seen = [[] for _ in range(sessions)]
+  categories = [str(random.randint(0, len(CATEGORIES))) for _ in range(sessions)]
+  timings = []
+  for _ in range(rounds):
+    for session in range(sessions):
+      query = 'category=%s&prevQuestions=%s' % (categories[session], ','.join(seen[session]))
+      start = time.perf_counter()
+      response = client.post('%s?%s' % (url, query))
+      timings.append(time.perf_counter() - start)
+      question = json.loads(response.data)['question']
+      if question:
+        seen[session].append(str(question['id']))
+  return timings
+
+
+def play_server_sessions(client, sessions, rounds):
+  '''play_sessions() through /quizzes/sessions: the deck is dealt when the
+  quiz starts, and every question after that is a pop.'''
+  timings = []
+  session_ids = []
+  for _ in range(sessions):
+    start = time.perf_counter()
+    response = client.post('/quizzes/sessions?category=%d&questions=%d'
+                           % (random.randint(0, len(CATEGORIES)), rounds))
+    timings.append(time.perf_counter() - start)
+    session_ids.append(json.loads(response.data)['session_id'])
+  for _ in range(rounds - 1):
+    for session_id in session_ids:
+      start = time.perf_counter()
+      client.post('/quizzes/sessions/%s/next' % session_id)
+      timings.append(time.perf_counter() - start)
+  return timings
+
+
+def percentile(timings, percent):
+  ordered = sorted(timings)
+  return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def bench_quiz(app, args):
+  app.add_url_rule('/legacy-quizzes', 'legacy_play_quiz', legacy_play_quiz, methods=['POST'])
+  client = app.test_client()
+  print('%10s  %-7s  %12s  %10s  %10s' % ('questions', 'picker', 'requests/s', 'p50 ms', 'p99 ms'))
+  for size in args.sizes or [1000, 10000, 100000]:
+    reset_database()
+    seed_questions(size)
+    for name in args.pickers:
+      if name == 'session':
+        timings = play_server_sessions(client, args.sessions, args.rounds)
+      else:
+        url = '/legacy-quizzes' if name == 'legacy' else '/quizzes'
+        timings = play_sessions(client, url, args.sessions, args.rounds)
+      print('%10d  %-7s  %12.0f  %10.3f  %10.3f' % (
+        size, name, len(timings) / sum(timings),
+        statistics.median(timings) * 1000, percentile(timings, 99) * 1000))
+
+
+def bench_search(app, args):
+  client = app.test_client()
+  terms = WORDS + ['%s %s' % pair for pair in zip(WORDS, reversed(WORDS))]
+  print('%10s  %10s  %10s  %10s' % ('questions', 'p50 ms', 'p99 ms', 'max ms'))
+  for size in args.sizes or [1000000]:
+    reset_database()
+    seed_questions(size)
+    timings = []
+    for _ in range(args.requests):
+      url = '/questions/search?term=%s&page=%d' % (random.choice(terms), random.randint(1, 5))
+      start = time.perf_counter()
+      client.post(url)
+      timings.append(time.perf_counter() - start)
+    print('%10d  %10.3f  %10.3f  %10.3f' % (
+      size, statistics.median(timings) * 1000, percentile(timings, 99) * 1000,
+      max(timings) * 1000))
+
+
+BENCHMARKS = {
+  'quiz': bench_quiz,
+  'search': bench_search,
+}
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark trivia API endpoints.')
+  parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+  parser.add_argument('--database-url', default='sqlite://')
+  parser.add_argument('--sizes', type=int, nargs='+')
+  parser.add_argument('--sessions', type=int, default=10000,
+                      help='Quiz sessions played side by side (quiz).')
+  parser.add_argument('--rounds', type=int, default=5,
+                      help='Questions asked in every session (quiz).')
+  parser.add_argument('--requests', type=int, default=200,
+                      help='Searches timed per size (search).')
+  parser.add_argument('--pickers', nargs='+', default=['legacy', 'pool', 'session'],
+                      choices=['legacy', 'pool', 'session'],
+                      help='Question pickers to compare (quiz).')
+  args = parser.parse_args()
+
+  random.seed(0)
+  # Slow searches on SQLite would otherwise each be logged as a warning.
+  app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url, 'SQL_SLOW_QUERY_MS': float('inf')})
+  with app.app_context():
+    BENCHMARKS[args.benchmark](app, args)
+
+
+if __name__ == '__main__':
+  main()
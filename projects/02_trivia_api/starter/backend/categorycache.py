@@ -0,0 +1,32 @@
+#----------------------------------------------------------------------------#
+# Process-local cache of the category table.
+#
+# Every endpoint that needs the categories reads them from here; the table is
+# queried again only after a commit that writes to it, after
+# CATEGORY_CACHE_TTL seconds (see tablecache.py), or when
+# POST /admin/categories/refresh forces it.
+#----------------------------------------------------------------------------#
+
+from models import db, Category
+from tablecache import TableCache
+
+
+class CategoryCache(TableCache):
+
+  ttl_setting = 'CATEGORY_CACHE_TTL'
+  extension = 'category_cache'
+
+  def load(self):
+    return tuple((row.id, row.type) for row in
+                 db.session.query(Category.id, Category.type).order_by(Category.id))
+
+  def all(self):
+    '''((id, type), ...) for every category, in id order.'''
+    return self.get('categories', [Category.__tablename__], self.load)
+
+  def refresh(self):
+    self.invalidate([Category.__tablename__])
+    return self.all()
+
+
+category_cache = CategoryCache()
@@ -0,0 +1,107 @@
+#----------------------------------------------------------------------------#
+# Conditional GET for the read views.
+#
+# Every transaction that writes to a table bumps that table's row in
+# table_version. A view decorated with @conditional('venue', 'show') reads
+# the stamps of the tables it is rendered from, in one small query, and
+# answers a matching If-None-Match / If-Modified-Since with a 304 before
+# running any query of its own. Otherwise the response carries a weak ETag
+# derived from the stamps and the newest change as Last-Modified.
+#
+# ORM writes are stamped from the session; writes that bypass it must call
+# bump_versions() themselves. Set ETAG_SALT to something new on
+# each deploy so that pages rendered by older templates are not revalidated.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+
+from models import db, TableVersion
+
+table_version = TableVersion.__table__
+
+
+def bump_versions(connection, tables):
+  # Sorted so that concurrent writers lock the rows in the same order.
+  now = datetime.utcnow().replace(microsecond=0)
+  if connection.dialect.name == 'postgresql':
+    # One upsert: the first writes to a table from two transactions cannot
+    # both insert its row, which would fail the second one on the key.
+    statement = postgresql.insert(table_version).values(
+      [{"name": name, "version": 1, "changed_at": now} for name in sorted(tables)])
+    connection.execute(statement.on_conflict_do_update(
+      index_elements=[table_version.c.name],
+      set_={"version": table_version.c.version + 1, "changed_at": statement.excluded.changed_at}))
+    return
+  # Elsewhere (SQLite) writers are serialized by the database lock, so the
+  # row cannot appear between the update and the insert.
+  for name in sorted(tables):
+    updated = connection.execute(
+      table_version.update().where(table_version.c.name == name)
+      .values(version=table_version.c.version + 1, changed_at=now)).rowcount
+    if not updated:
+      connection.execute(table_version.insert(), {"name": name, "version": 1, "changed_at": now})
+
+
+def read_stamp(tables, period=None):
+  '''Return (etag, last modified) for the current state of `tables`.'''
+  rows = {row.name: row for row in db.session.query(
+    TableVersion.name, TableVersion.version, TableVersion.changed_at)
+    .filter(TableVersion.name.in_(tables))}
+  parts = [current_app.config.get('ETAG_SALT', '')]
+  parts += ['%s:%d' % (name, rows[name].version if name in rows else 0) for name in tables]
+  changes = [row.changed_at for row in rows.values()]
+  if period:
+    # Views that classify shows against the clock change on their own.
+    bucket = int(time.time() // period)
+    parts.append('t:%d' % bucket)
+    changes.append(datetime.utcfromtimestamp(bucket * period))
+  etag = hashlib.sha1(';'.join(parts).encode('utf-8')).hexdigest()
+  return etag, max(changes) if changes else None
+
+
+def conditional(*tables, period=None):
+  '''Serve the view with an ETag/Last-Modified stamped from `tables`, and
+  with a 304 when the client's copy is still current. `period` (seconds)
+  additionally expires the stamp on the clock.'''
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      # Pages carrying a flashed message are one-offs.
+      if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        return view(*args, **kwargs)
+      etag, last_modified = read_stamp(tables, period)
+      if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+      else:
+        fresh = last_modified is not None and request.if_modified_since is not None \
+          and last_modified <= request.if_modified_since
+      if fresh:
+        response = current_app.response_class(status=304)
+      else:
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+          return response
+      response.set_etag(etag, weak=True)
+      if last_modified is not None:
+        response.last_modified = last_modified
+      response.cache_control.no_cache = True
+      return response
+    return wrapper
+  return decorator
+
+
+# Stamp the tables an ORM flush wrote to, in the flush's own transaction.
+
+@event.listens_for(db.session, 'after_flush')
+def stamp_tables(session, flush_context):
+  tables = {instance.__table__.name for instance in session.new | session.dirty | session.deleted
+            if hasattr(instance, '__table__') and not isinstance(instance, TableVersion)}
+  if tables:
+    bump_versions(session.connection(), tables)
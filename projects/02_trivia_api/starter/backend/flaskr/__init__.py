@@ -1,29 +1,65 @@
 import os
-import sys
+import hmac
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
 
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.sql.sqltypes import String
 from models import setup_db, Question, Category
+from sqlprofile import sql_profiler
+from conditional import conditional
+from rowcount import row_counts
+from categorycache import category_cache
+from quiz import question_pool, pick_question
+from quizsession import quiz_sessions
+from search import search_questions
 
 QUESTIONS_PER_PAGE = 10
+QUIZ_LENGTH = 5
+QUIZ_MAX_LENGTH = 100
 
-def paginate_questions(request, selection):
-    
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
-    return current_questions
+def paginate_questions(request, query):
+    '''One page of `query` in id order, read with LIMIT in the database.
+
+    ?page=N skips the earlier pages with OFFSET. ?after=<id>, the
+    next_cursor of the previous page, seeks past them on the primary key
+    instead, so deep pages cost the same as the first one.
+    Returns (questions, next cursor or None).
+    '''
+    query = query.order_by(Question.id)
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.filter(Question.id > after)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], None
+        query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
+    selection = query.limit(QUESTIONS_PER_PAGE + 1).all()
+    next_cursor = None
+    if len(selection) > QUESTIONS_PER_PAGE:
+        selection = selection[:QUESTIONS_PER_PAGE]
+        next_cursor = selection[-1].id
+    return [question.format() for question in selection], next_cursor
   
 
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
-  setup_db(app)
+  if test_config:
+      app.config.from_mapping(test_config)
+  if 'SQLALCHEMY_DATABASE_URI' in app.config:
+      setup_db(app, app.config['SQLALCHEMY_DATABASE_URI'])
+  else:
+      setup_db(app)
+  sql_profiler.init_app(app)
+  row_counts.init_app(app)
+  category_cache.init_app(app)
+  question_pool.init_app(app)
+  quiz_sessions.init_app(app)
+  app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
   CORS(app, resources={"r*/api/*": {"origins": "*"}},send_wildcard=True )
 
   '''
@@ -45,10 +81,11 @@ def create_app(test_config=None):
   for all available categories.
   '''
   @app.route('/categories')
+  @conditional('categories')
   def get_categories():
     
-    selection = Category.query.all()
-    categories = {category.id : category.type for category in selection}   
+    selection = category_cache.all()
+    categories = {id : type for id, type in selection}   
     
     if len(selection) == 0:
             abort(404)
@@ -56,9 +93,23 @@ def create_app(test_config=None):
         return jsonify({
         'success': True,
         'categories': categories,
-        'total_categories': len(Category.query.all())
+        'total_categories': len(selection)
         }) 
 
+  @app.route('/admin/categories/refresh', methods=['POST'])
+  def refresh_categories():
+    # Reloads this process's category cache, e.g. after editing the table by
+    # hand. Requires "Authorization: Bearer <ADMIN_TOKEN>".
+    token = app.config.get('ADMIN_TOKEN')
+    if not token or not hmac.compare_digest(
+            request.headers.get('Authorization', ''), 'Bearer ' + token):
+        abort(403)
+    selection = category_cache.refresh()
+    return jsonify({
+        'success': True,
+        'total_categories': len(selection)
+        })
+
   '''
   @TODO: 
   Create an endpoint to handle GET requests for questions, 
@@ -72,13 +123,11 @@ def create_app(test_config=None):
   Clicking on the page numbers should update the questions. 
   '''
   @app.route('/questions')
+  @conditional('questions', 'categories')
   def get_questions():
-    selection = Question.query.all()
-    categories_selection = Category.query.all()
+    current_questions, next_cursor = paginate_questions(request, Question.query)
 
-    current_questions = paginate_questions(request, selection)
-
-    current_categories = [category.type for category in categories_selection]
+    current_categories = [type for id, type in category_cache.all()]
     if len(current_questions) == 0:
         abort(404)
         
@@ -87,7 +136,8 @@ def create_app(test_config=None):
         'success': True,
         'questions': current_questions,
         'categories': current_categories,
-        'total_questions': len(Question.query.all()),
+        'total_questions': row_counts.count('questions', Question.query),
+        'next_cursor': next_cursor,
         'current_category': None
         })
   '''
@@ -135,14 +185,13 @@ def create_app(test_config=None):
             )
             question.insert()
             
-            selection = Question.query.order_by(Question.id).all()
-            current_questions = paginate_questions(request, selection)
+            current_questions, next_cursor = paginate_questions(request, Question.query)
             
             return jsonify({
             'success': True,
             'created_id': question.id,
             'questions': current_questions,
-            'total_questions': len(Question.query.all())
+            'total_questions': row_counts.count('questions', Question.query)
             })
         else:
            abort(422)
@@ -160,18 +209,24 @@ def create_app(test_config=None):
   '''
   @app.route('/questions/search', methods=['POST'])
   def search_question():
-    term = request.args.get('term', '')
+    # Ranked matches, QUESTIONS_PER_PAGE at a time (?page=N).
+    term = request.args.get('term', '').strip()
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
     try:
-        selection = Question.query.filter(Question.question.ilike("%" + term + "%")).order_by(Question.id).all()
-        #current_questions = paginate_questions(request, selection)
-        questions = [question.format() for question in selection]
-        return jsonify({
-            'success': True,
-            'questions': questions,
-            })
+        total, selection = search_questions(term, (page - 1) * QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE)
     except:
-        print(sys.exc_info())
+        app.logger.exception('Search for %r failed', term)
         abort(422)
+
+    if not selection and page > 1:
+        abort(404)
+    return jsonify({
+        'success': True,
+        'questions': [question.format() for question in selection],
+        'total_questions': total,
+        })
   '''
   @TODO: 
   Create a GET endpoint to get questions based on category. 
@@ -205,53 +260,57 @@ def create_app(test_config=None):
   '''
   @app.route('/quizzes', methods=['POST'])
   def play_quiz():
-      
+    category = request.args.get('category')
+    seen = {int(id) for id in request.args.get('prevQuestions', '').split(',')
+            if id.strip().isdigit()}
     try:
-        body = request.get_json()
+        quiz_question = pick_question(None if category in (None, '', '0') else category, seen)
+    except SQLAlchemyError:
+        app.logger.exception('Quiz question could not be picked')
+        abort(404)
 
-        category = request.args.get('category')
-        previous_questions_args = request.args.get('prevQuestions', [])
-        
-        formatted_previous_questions = previous_questions_args.split(",")        
-        quiz_question = None
+    return jsonify({
+        'success': True,
+        'question': quiz_question,
+        })
 
-        if previous_questions_args:
-            
-            if category == '0':
-                questions = Question.query.all()
-            else:
-                questions = Question.query.filter(Question.category.in_(category)).all() #if previous_questions is None else Question.query.filter(~Question.id.in_(previous_questions), Question.category.in_(category)).all()
-            
-            
-            quiz_questions = []
-            
-            for question in questions:
-                quiz_questions.append(str(question.id))
+  @app.route('/quizzes/sessions', methods=['POST'])
+  def start_quiz():
+    # Deals a shuffled deck of ?questions= (default 5) questions from
+    # ?category= (0 for all) and keeps it on the server; the client then only
+    # sends the session id back.
+    category = request.args.get('category', '0')
+    length = request.args.get('questions', QUIZ_LENGTH, type=int)
+    if length < 1 or length > QUIZ_MAX_LENGTH:
+        abort(400)
+
+    session_id, total = quiz_sessions.start(None if category in ('', '0') else category, length)
+    return jsonify({
+        'success': True,
+        'session_id': session_id,
+        'total_questions': total,
+        }), 201
+
+  @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+  def next_quiz_question(session_id):
+    try:
+        question, remaining = quiz_sessions.next(session_id)
+    except KeyError:
+        abort(404)
+
+    return jsonify({
+        'success': True,
+        'question': question,
+        'remaining_questions': remaining,
+        })
+
+  @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+  def end_quiz(session_id):
+    quiz_sessions.end(session_id)
+    return jsonify({
+        'success': True,
+        })
 
-            for previous_question in formatted_previous_questions:
-                if previous_question in quiz_questions:
-                    print('removing question')
-                    quiz_questions.remove(previous_question)
-                   
-            print(list(dict.fromkeys(quiz_questions)))
-            if quiz_questions:
-                quiz_question_id = random.choice(list(dict.fromkeys(quiz_questions)))
-                quiz_question = Question.query.get(quiz_question_id)
-        
-        else:
-            print('First question case')
-            if category == '0':
-                quiz_question = Question.query.first()
-            else:
-                quiz_question = Question.query.filter(Question.category.in_(category)).first()
-       
-        return jsonify({
-            'success': True,
-            'question': quiz_question.format() if quiz_question else None,
-            })
-    except:
-        print(sys.exc_info())
-        abort(404) 
   '''
   @TODO: 
   Create error handlers for all expected errors 
@@ -281,6 +340,22 @@ def create_app(test_config=None):
           'message': 'bad request',
           }), 400
 
+  @app.errorhandler(401)
+  def unauthorized(error):
+      return jsonify({
+          'success': False,
+          'error': 401,
+          'message': 'unauthorized',
+          }), 401
+
+  @app.errorhandler(403)
+  def forbidden(error):
+      return jsonify({
+          'success': False,
+          'error': 403,
+          'message': 'forbidden',
+          }), 403
+
   @app.errorhandler(405)
   def method_not_found(error):
       return jsonify({
@@ -0,0 +1,14 @@
+-- GIN index for full-text question search (QUESTION_DOCUMENT in models.py;
+-- the expression must stay identical to it for the index to be used).
+--
+--   psql trivia < migrations/001_question_search.sql
+--
+-- CONCURRENTLY keeps the table writable while the index builds, and cannot
+-- run inside a transaction block.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_document ON questions
+    USING gin ((setweight(to_tsvector('english', coalesce(question, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(answer, '')), 'B')));
+
+-- To undo:
+--   DROP INDEX CONCURRENTLY IF EXISTS ix_questions_document;
@@ -1,9 +1,10 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, String, Integer, DateTime, DDL, create_engine, event
 import json
 from dotenv import load_dotenv
 
+from dbpool import PooledSQLAlchemy, register_metrics
+
 load_dotenv(dotenv_path='config.env')
 
 DB_HOST = os.getenv('DB_HOST')  
@@ -12,7 +13,7 @@ DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_NAME = os.getenv('PGDATABASE', 'trivia')  
 DB_PATH = 'postgresql://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
 
-db = SQLAlchemy()
+db = PooledSQLAlchemy()
 
 '''
 setup_db(app)
@@ -21,11 +22,12 @@ setup_db(app)
 def setup_db(app, database_path=DB_PATH):
     print('here :   ')
     print(DB_PATH)
-    app.config["SQLALCHEMY_DATABASE_URI"] = DB_PATH
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
     db.create_all()
+    register_metrics(app, db)
 
 '''
 Question
@@ -66,6 +68,18 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+'''
+Full-text search document of a question: the question text, weighted above
+the answer. PostgreSQL indexes it with GIN when the table is created;
+migrations/001_question_search.sql adds the index to existing databases.
+'''
+QUESTION_DOCUMENT = ("setweight(to_tsvector('english', coalesce(question, '')), 'A') || "
+                     "setweight(to_tsvector('english', coalesce(answer, '')), 'B')")
+
+event.listen(Question.__table__, 'after_create', DDL(
+  'CREATE INDEX ix_questions_document ON questions USING gin ((%s))' % QUESTION_DOCUMENT
+).execute_if(dialect='postgresql'))
+
 '''
 Category
 
@@ -83,4 +97,16 @@ class Category(db.Model):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+TableVersion
+A version stamp per table, bumped in every transaction that writes to it;
+see conditional.py
+'''
+class TableVersion(db.Model):
+  __tablename__ = 'table_version'
+
+  name = Column(String(64), primary_key=True)
+  version = Column(Integer, nullable=False, default=0)
+  changed_at = Column(DateTime, nullable=False)
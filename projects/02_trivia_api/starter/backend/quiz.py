@@ -0,0 +1,58 @@
+#----------------------------------------------------------------------------#
+# Quiz question selection.
+#
+# QuestionPool keeps every question, formatted, and their ids grouped by
+# category in process memory: one query loads them, and they are reloaded
+# only after a commit that writes questions or after QUIZ_POOL_TTL seconds
+# (see tablecache.py). Picking the next question is then a draw from that
+# pool, with the questions already asked held in a set, and no query at all.
+#----------------------------------------------------------------------------#
+
+import random
+
+from models import Question
+from tablecache import TableCache
+
+
+class QuestionPool(TableCache):
+
+  ttl_setting = 'QUIZ_POOL_TTL'
+  extension = 'question_pool'
+
+  def load(self):
+    '''({category: (id, ...), None: every id}, {id: formatted question}).'''
+    categories = {}
+    questions = {}
+    for question in Question.query.order_by(Question.id):
+      categories.setdefault(str(question.category), []).append(question.id)
+      questions[question.id] = question.format()
+    categories = {category: tuple(ids) for category, ids in categories.items()}
+    categories[None] = tuple(questions)
+    return categories, questions
+
+  def pool(self):
+    return self.get('questions', [Question.__tablename__], self.load)
+
+  def ids(self, category=None):
+    '''Ids of the questions in `category` (of all questions when None).'''
+    return self.pool()[0].get(category, ())
+
+
+question_pool = QuestionPool()
+
+
+def pick_question(category, seen):
+  '''A random question, formatted, in `category` (any category when None)
+  whose id is not in the set `seen`; None once every question has been
+  asked.'''
+  categories, questions = question_pool.pool()
+  ids = categories.get(category, ())
+  if len(seen) * 2 < len(ids):
+    # At least half of the pool is unseen, so this takes two draws on
+    # average, however large the pool.
+    while True:
+      id = random.choice(ids)
+      if id not in seen:
+        return questions[id]
+  remaining = [id for id in ids if id not in seen]
+  return questions[random.choice(remaining)] if remaining else None
@@ -0,0 +1,157 @@
+#----------------------------------------------------------------------------#
+# Server-side quiz sessions.
+#
+# Starting a quiz deals a deck: the requested number of questions drawn at
+# random from the question pool (see quiz.py) and stored under a new session
+# id. Every "next question" is then a pop from the front of that deck,
+# without touching the database, and the client only has to remember the
+# session id.
+#
+# Decks live in QUIZ_SESSION_STORE:
+#
+#   memory://                       this process only (the default)
+#   redis://localhost:6379/0        Redis, or anything speaking its protocol,
+#                                   shared by every process; needs `redis`
+#
+# and expire QUIZ_SESSION_TTL seconds after the quiz started.
+#----------------------------------------------------------------------------#
+
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+from quiz import question_pool
+
+
+class MemoryStore(object):
+  '''Decks in a dict. Sessions all expire after the same time, so they
+  expire in the order they were created and the oldest are purged first.'''
+
+  def __init__(self):
+    self.decks = OrderedDict()
+    self.lock = threading.Lock()
+
+  def purge(self, now):
+    while self.decks:
+      session_id, (_, expires) = next(iter(self.decks.items()))
+      if expires > now:
+        break
+      del self.decks[session_id]
+
+  def create(self, session_id, deck, timeout):
+    now = time.monotonic()
+    with self.lock:
+      self.purge(now)
+      self.decks[session_id] = (deque(deck), now + timeout)
+
+  def pop(self, session_id):
+    with self.lock:
+      entry = self.decks.get(session_id)
+      if entry is None or entry[1] <= time.monotonic():
+        raise KeyError(session_id)
+      deck = entry[0]
+      return (deck.popleft() if deck else None), len(deck)
+
+  def delete(self, session_id):
+    with self.lock:
+      self.decks.pop(session_id, None)
+
+
+class RedisStore(object):
+  '''Decks as Redis lists of JSON questions. Each list ends with an empty
+  marker that is never handed out, so a finished deck can be told apart
+  from an unknown or expired session.'''
+
+  END = b''
+
+  # Pops the front of the deck unless it is the end marker, which stays in
+  # place so the list, and the TTL set on it, outlive the last question.
+  POP_FRONT = """
+  local question = redis.call('LINDEX', KEYS[1], 0)
+  if not question then
+    return false
+  end
+  if question ~= '' then
+    redis.call('LPOP', KEYS[1])
+  end
+  return {question, redis.call('LLEN', KEYS[1])}
+  """
+
+  def __init__(self, url):
+    try:
+      import redis
+    except ImportError:
+      raise RuntimeError('QUIZ_SESSION_STORE %r needs the redis package' % url)
+    self.client = redis.Redis.from_url(url)
+    self.pop_front = self.client.register_script(self.POP_FRONT)
+
+  def key(self, session_id):
+    return 'quiz:%s' % session_id
+
+  def create(self, session_id, deck, timeout):
+    key = self.key(session_id)
+    pipeline = self.client.pipeline()
+    pipeline.rpush(key, *[json.dumps(question) for question in deck], self.END)
+    pipeline.expire(key, int(timeout))
+    pipeline.execute()
+
+  def pop(self, session_id):
+    result = self.pop_front(keys=[self.key(session_id)])
+    if result is None:
+      raise KeyError(session_id)
+    question, length = result
+    if question == self.END:
+      return None, 0
+    return json.loads(question), length - 1
+
+  def delete(self, session_id):
+    self.client.delete(self.key(session_id))
+
+
+def open_store(url):
+  if url.startswith(('redis://', 'rediss://', 'unix://')):
+    return RedisStore(url)
+  if url == 'memory://':
+    return MemoryStore()
+  raise ValueError('Unknown QUIZ_SESSION_STORE %r' % url)
+
+
+class QuizSessions(object):
+
+  def __init__(self, app=None):
+    self.store = None
+    self.timeout = 3600
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('QUIZ_SESSION_STORE', os.environ.get('QUIZ_SESSION_STORE', 'memory://'))
+    app.config.setdefault('QUIZ_SESSION_TTL', self.timeout)
+    self.store = open_store(app.config['QUIZ_SESSION_STORE'])
+    self.timeout = app.config['QUIZ_SESSION_TTL']
+    app.extensions['quiz_sessions'] = self
+
+  def start(self, category, length):
+    '''Deal a deck of up to `length` questions from `category` (any category
+    when None). Returns (session id, number of questions).'''
+    categories, questions = question_pool.pool()
+    ids = categories.get(category, ())
+    deck = [questions[id] for id in random.sample(ids, min(length, len(ids)))]
+    session_id = secrets.token_urlsafe(16)
+    self.store.create(session_id, deck, self.timeout)
+    return session_id, len(deck)
+
+  def next(self, session_id):
+    '''(question, questions left) of the session; the question is None once
+    the deck is finished. KeyError for unknown and expired sessions.'''
+    return self.store.pop(session_id)
+
+  def end(self, session_id):
+    self.store.delete(session_id)
+
+
+quiz_sessions = QuizSessions()
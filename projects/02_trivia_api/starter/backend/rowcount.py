@@ -0,0 +1,31 @@
+#----------------------------------------------------------------------------#
+# Cached row counts.
+#
+# Paginated listings report a total alongside each page; counting the table
+# on every request would make every page cost as much as the whole table.
+# RowCountCache keeps each COUNT(*) in process memory (see tablecache.py)
+# until a commit writes to the counted table, or ROW_COUNT_TTL seconds pass.
+#
+#   total = row_counts.count('questions', Question.query)
+#   in_category = row_counts.count('questions:category=3', query)
+#
+# Keys start with the name of the table they count.
+#----------------------------------------------------------------------------#
+
+from tablecache import TableCache
+
+
+class RowCountCache(TableCache):
+
+  ttl_setting = 'ROW_COUNT_TTL'
+  extension = 'row_counts'
+
+  def __init__(self, app=None, timeout=60):
+    super().__init__(app, timeout)
+
+  def count(self, key, query):
+    '''COUNT(*) of `query`, cached under `key`.'''
+    return self.get(key, [key.split(':', 1)[0]], query.order_by(None).count)
+
+
+row_counts = RowCountCache()
@@ -0,0 +1,45 @@
+#----------------------------------------------------------------------------#
+# Question search.
+#
+# On PostgreSQL a search is a full-text query against QUESTION_DOCUMENT,
+# answered from its GIN index and ranked with ts_rank, so words match in any
+# order and in any inflection ("planets" finds "planet"). Other databases
+# (SQLite in development) fall back to a case-insensitive substring match on
+# the question and the answer. Either way one query returns a page of
+# matches, best first, together with the total number of matches.
+#----------------------------------------------------------------------------#
+
+from sqlalchemy import case, func, literal_column, or_
+
+from models import db, Question, QUESTION_DOCUMENT
+
+
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_questions(term, offset, limit):
+  '''(total matches, [question, ...]) for the matches of `term` from
+  `offset`, at most `limit` of them. A blank term matches nothing.'''
+  if not term.strip():
+    # plainto_tsquery('') matches no document, while LIKE '%%' would match
+    # every row; keep both backends to the former.
+    return 0, []
+  total = func.count().over().label('total')
+  if db.engine.dialect.name == 'postgresql':
+    document = literal_column('(%s)' % QUESTION_DOCUMENT)
+    query = func.plainto_tsquery('english', term)
+    rows = db.session.query(Question, total) \
+      .filter(document.op('@@')(query)) \
+      .order_by(func.ts_rank(document, query).desc(), Question.id)
+  else:
+    pattern = '%' + escape_like(term) + '%'
+    in_question = Question.question.ilike(pattern, escape='\\')
+    # Matches in the question rank above matches in the answer only, and
+    # earlier matches above later ones.
+    rows = db.session.query(Question, total) \
+      .filter(or_(in_question, Question.answer.ilike(pattern, escape='\\'))) \
+      .order_by(case([(in_question, 0)], else_=1),
+                func.instr(func.lower(Question.question), term.lower()), Question.id)
+  rows = rows.offset(offset).limit(limit).all()
+  return (rows[0].total if rows else 0), [row.Question for row in rows]
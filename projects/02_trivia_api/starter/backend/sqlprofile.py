@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------#
+# Per-request SQL profiling.
+#
+# SQLProfiler counts the statements each request runs and the time spent in
+# them, and reports both in a Server-Timing response header (shown in the
+# browser's network panel):
+#
+#   Server-Timing: db;desc="3 queries";dur=4.12
+#
+# Statements slower than SQL_SLOW_QUERY_MS are logged as warnings together
+# with the endpoint that ran them. Statements run outside of a request, e.g.
+# from the CLI, are not profiled.
+#
+# Every app in this repository is deployed on its own and carries a copy of
+# this module; the copies are identical apart from the coffee shop's
+# four-space indentation, so change them together.
+#----------------------------------------------------------------------------#
+
+import os
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class RequestProfile(object):
+
+  def __init__(self):
+    self.queries = 0
+    self.seconds = 0.0
+
+
+class SQLProfiler(object):
+
+  def __init__(self, app=None):
+    self.listening = False
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('SQL_PROFILE', True)
+    app.config.setdefault('SQL_SLOW_QUERY_MS', float(os.environ.get('SQL_SLOW_QUERY_MS', 100)))
+    app.extensions['sql_profiler'] = self
+    app.before_request(self.start_request)
+    app.after_request(self.finish_request)
+    if not self.listening:
+      # Listening on the Engine class covers engines created later, which
+      # Flask-SQLAlchemy does lazily on first use.
+      event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+      event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+      self.listening = True
+
+  def start_request(self):
+    if current_app.config['SQL_PROFILE']:
+      g.sql_profile = RequestProfile()
+
+  def finish_request(self, response):
+    profile = g.pop('sql_profile', None)
+    if profile is None:
+      return response
+    response.headers.add('Server-Timing', 'db;desc="%d %s";dur=%.2f' % (
+      profile.queries, 'query' if profile.queries == 1 else 'queries', profile.seconds * 1000))
+    current_app.logger.debug('%s: %d queries in %.1f ms', request.endpoint,
+                             profile.queries, profile.seconds * 1000)
+    return response
+
+  def current_profile(self):
+    if not has_request_context() or current_app.extensions.get('sql_profiler') is not self:
+      return None
+    return g.get('sql_profile')
+
+  def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if self.current_profile() is not None:
+      conn.info.setdefault('sql_profile_started', []).append(time.perf_counter())
+
+  def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    profile = self.current_profile()
+    started = conn.info.get('sql_profile_started')
+    if profile is None or not started:
+      return
+    elapsed = time.perf_counter() - started.pop()
+    profile.queries += 1
+    profile.seconds += elapsed
+    if elapsed * 1000 >= current_app.config['SQL_SLOW_QUERY_MS']:
+      current_app.logger.warning('Slow query (%.1f ms) in %s: %s', elapsed * 1000,
+                                 request.endpoint, statement)
+
+
+sql_profiler = SQLProfiler()
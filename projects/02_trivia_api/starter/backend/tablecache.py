@@ -0,0 +1,105 @@
+#----------------------------------------------------------------------------#
+# Process-local caches of values read from the database.
+#
+# A TableCache keeps each value under a key, together with the tables it was
+# read from, until a commit writes to one of those tables or the cache's TTL
+# passes (the bound on how stale a value can be for writes made by other
+# processes or outside the ORM). One set of session listeners collects the
+# tables every transaction writes and, once it commits, invalidates the
+# caches that have read from them; the caches themselves only supply a
+# loader:
+#
+#   value = cache.get('key', ['questions'], load)
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+
+from sqlalchemy import event
+
+from models import db
+
+# Table name -> the caches holding values read from it.
+readers = {}
+readers_lock = threading.Lock()
+
+
+class TableCache(object):
+  '''Subclasses name the config key of their TTL in `ttl_setting` and their
+  key in app.extensions in `extension`.'''
+
+  ttl_setting = None
+  extension = None
+
+  def __init__(self, app=None, timeout=300):
+    self.timeout = timeout
+    self.entries = {}
+    self.generations = {}
+    self.lock = threading.Lock()
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault(self.ttl_setting, self.timeout)
+    self.timeout = app.config[self.ttl_setting]
+    app.extensions[self.extension] = self
+
+  def get(self, key, tables, load):
+    '''The value cached under `key`, or the result of `load()`, kept until
+    one of `tables` is written to.'''
+    now = time.monotonic()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None and entry[1] > now:
+        return entry[0]
+      generation = [self.generations.get(table, 0) for table in tables]
+    with readers_lock:
+      for table in tables:
+        readers.setdefault(table, set()).add(self)
+    value = load()
+    with self.lock:
+      # A commit that landed while loading makes the value unsafe to keep.
+      if [self.generations.get(table, 0) for table in tables] == generation:
+        self.entries[key] = (value, now + self.timeout, frozenset(tables))
+    return value
+
+  def invalidate(self, tables):
+    with self.lock:
+      for table in tables:
+        self.generations[table] = self.generations.get(table, 0) + 1
+      for key in [key for key, entry in self.entries.items()
+                  if not entry[2].isdisjoint(tables)]:
+        del self.entries[key]
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+
+# Invalidate the caches that read from the tables a transaction wrote to
+# once it commits.
+
+@event.listens_for(db.session, 'after_flush')
+def collect_tables(session, flush_context):
+  session.info.setdefault('written_tables', set()).update(
+    instance.__table__.name for instance in session.new | session.dirty | session.deleted
+    if hasattr(instance, '__table__'))
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_caches(session):
+  tables = session.info.pop('written_tables', None)
+  if not tables:
+    return
+  with readers_lock:
+    caches = {}
+    for table in tables:
+      for cache in readers.get(table, ()):
+        caches.setdefault(cache, set()).add(table)
+  for cache, written in caches.items():
+    cache.invalidate(written)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_tables(session):
+  session.info.pop('written_tables', None)
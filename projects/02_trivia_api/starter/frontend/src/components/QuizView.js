@@ -10,6 +10,7 @@ class QuizView extends Component {
     super();
     this.state = {
         quizCategory: null,
+        quizSession: null,
         previousQuestions: [], 
         showAnswer: false,
         categories: {},
@@ -36,7 +37,24 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.startQuiz)
+  }
+
+  startQuiz = () => {
+    $.ajax({
+      url: `http://127.0.0.1:5000/quizzes/sessions?category=${this.state.quizCategory.id}&questions=${questionsPerPlay}`,
+      type: "POST",
+      dataType: 'json',
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ quizSession: result.session_id }, this.getNextQuestion)
+        return;
+      },
+      error: (error) => {
+        alert('Unable to start the quiz. Please try your request again')
+        return;
+      }
+    })
   }
 
   handleChange = (event) => {
@@ -47,20 +65,10 @@ class QuizView extends Component {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
-    console.log(previousQuestions)
-
     $.ajax({
-      url: `http://127.0.0.1:5000/quizzes?category=${this.state.quizCategory.id}&prevQuestions=${previousQuestions}`, //TODO: update request URL
+      url: `http://127.0.0.1:5000/quizzes/sessions/${this.state.quizSession}/next`,
       type: "POST",
       dataType: 'json',
-      contentType: 'application/json',
-      data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
-      }),
-     // xhrFields: {
-     //   withCredentials: true
-      //},
       crossDomain: true,
       success: (result) => {
         this.setState({
@@ -92,6 +100,7 @@ class QuizView extends Component {
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [], 
       showAnswer: false,
       numCorrect: 0,
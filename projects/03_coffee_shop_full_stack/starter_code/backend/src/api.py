@@ -4,11 +4,15 @@ from sqlalchemy import exc
 import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
+from .database.models import db_drop_and_create_all, setup_db, db, Drink
+from .database.dbpool import register_metrics
 from .auth.auth import AuthError, requires_auth
+from .sqlprofile import sql_profiler
 
 app = Flask(__name__)
 setup_db(app)
+register_metrics(app, db)
+sql_profiler.init_app(app)
 CORS(app)
 
 '''
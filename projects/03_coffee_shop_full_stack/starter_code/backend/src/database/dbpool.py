@@ -0,0 +1,202 @@
+#----------------------------------------------------------------------------#
+# Connection pool configuration and metrics.
+#
+# PooledSQLAlchemy is a drop-in replacement for flask_sqlalchemy.SQLAlchemy
+# that sizes the connection pool from the DB_POOL_* settings below (app
+# config first, then the environment) and counts checkouts, the time spent
+# waiting for a connection and overflow use. register_metrics() serves the
+# numbers on /metrics in the Prometheus text format. Under gunicorn every
+# worker has a pool of its own, so the samples carry the worker's pid.
+#
+# The numbers describe the database and the load on it, so /metrics is only
+# served when METRICS_TOKEN is set (app config first, then the environment),
+# and only to requests that send it as a bearer token:
+#
+#   curl -H "Authorization: Bearer $METRICS_TOKEN" localhost:5000/metrics
+#
+# An in-memory SQLite database lives on a single shared connection, so it
+# keeps Flask-SQLAlchemy's StaticPool and only the counters are reported.
+#
+# Every app in this repository is deployed on its own and carries a copy of
+# this module; the copies are identical apart from the coffee shop's
+# four-space indentation, so change them together.
+#----------------------------------------------------------------------------#
+
+import hmac
+import os
+import threading
+import time
+
+from flask import Response, abort, request
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+def parse_bool(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# setting: (parse from the environment, default)
+POOL_SETTINGS = {
+    'DB_POOL_SIZE': (int, 5),
+    'DB_MAX_OVERFLOW': (int, 10),
+    'DB_POOL_TIMEOUT': (float, 30),
+    'DB_POOL_RECYCLE': (int, 1800),
+    'DB_POOL_PRE_PING': (parse_bool, True),
+    # Milliseconds, PostgreSQL only; 0 leaves the server default.
+    'DB_STATEMENT_TIMEOUT': (int, 0),
+}
+
+
+class PoolMetrics(object):
+    '''Checkout counters shared by every pool of one PooledSQLAlchemy.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_overflow = 0
+
+    def record(self, wait, overflow=0, timed_out=False):
+        with self.lock:
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            if overflow > 0:
+                self.overflow_checkouts += 1
+                self.max_overflow = max(self.max_overflow, overflow)
+
+
+class InstrumentedQueuePool(QueuePool):
+    '''QueuePool that reports every checkout to its `metrics`.'''
+
+    metrics = None
+
+    # _do_get is the hook Pool implementations provide to hand out a
+    # connection record; both connect() and unique_connection() go through it.
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record(time.monotonic() - started, timed_out=True)
+            raise
+        self.metrics.record(time.monotonic() - started, self.overflow())
+        return record
+
+    def recreate(self):
+        # Called when the engine is disposed; keep counting into the same place.
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_metrics = PoolMetrics()
+
+    def init_app(self, app):
+        for name, (parse, default) in POOL_SETTINGS.items():
+            if name not in app.config:
+                value = os.environ.get(name)
+                app.config[name] = default if value is None else parse(value)
+        super().init_app(app)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super().apply_driver_hacks(app, sa_url, options)
+        if sa_url.drivername.startswith('sqlite') and sa_url.database in (None, '', ':memory:'):
+            return
+        options.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=app.config['DB_POOL_SIZE'],
+            max_overflow=app.config['DB_MAX_OVERFLOW'],
+            pool_timeout=app.config['DB_POOL_TIMEOUT'],
+            pool_recycle=app.config['DB_POOL_RECYCLE'],
+            pool_pre_ping=app.config['DB_POOL_PRE_PING'],
+        )
+        if sa_url.drivername.startswith('sqlite'):
+            # Pooled connections move between threads with each checkout.
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+        if sa_url.drivername.startswith('postgresql') and app.config['DB_STATEMENT_TIMEOUT']:
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = '-c statement_timeout=%d' % app.config['DB_STATEMENT_TIMEOUT']
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        if isinstance(engine.pool, InstrumentedQueuePool):
+            engine.pool.metrics = self.pool_metrics
+        return engine
+
+
+#  Metrics endpoint
+#  ----------------------------------------------------------------
+
+def pool_samples(db):
+    '''Return [(name, type, help, value), ...] for the pool behind `db`.'''
+    metrics = db.pool_metrics
+    with metrics.lock:
+        samples = [
+            ('db_pool_checkouts_total', 'counter', 'Connections checked out of the pool.',
+             metrics.checkouts),
+            ('db_pool_overflow_checkouts_total', 'counter',
+             'Checkouts made while the pool was past pool_size.', metrics.overflow_checkouts),
+            ('db_pool_timeouts_total', 'counter', 'Checkouts that gave up after pool_timeout.',
+             metrics.timeouts),
+            ('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.',
+             metrics.wait_seconds),
+            ('db_pool_wait_seconds_max', 'gauge', 'Longest wait for a connection.',
+             metrics.max_wait_seconds),
+            ('db_pool_overflow_max', 'gauge', 'Most overflow connections open at once.',
+             metrics.max_overflow),
+        ]
+    pool = db.get_engine().pool
+    if isinstance(pool, QueuePool):
+        samples += [
+            ('db_pool_size', 'gauge', 'Connections the pool keeps open.', pool.size()),
+            ('db_pool_checked_out', 'gauge', 'Connections currently checked out.', pool.checkedout()),
+            ('db_pool_overflow', 'gauge', 'Overflow connections currently open.', max(0, pool.overflow())),
+        ]
+    return samples
+
+
+def render_samples(samples, labels):
+    label = ','.join('%s="%s"' % item for item in sorted(labels.items()))
+    lines = []
+    for name, type, help, value in samples:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, type))
+        lines.append('%s{%s} %s' % (name, label, value))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_response(db):
+    text = render_samples(pool_samples(db), {'pid': os.getpid()})
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+def register_metrics(app, db, rule='/metrics'):
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+    # setup_db() may run more than once for the same app (the tests call it
+    # again after create_app()).
+    if 'metrics' in app.view_functions:
+        return
+
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        sent = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(sent.encode(), ('Bearer ' + token).encode()):
+            abort(401)
+        return metrics_response(db)
+
+    app.add_url_rule(rule, 'metrics', metrics)
@@ -1,8 +1,9 @@
 import os
 from sqlalchemy import Column, String, Integer
-from flask_sqlalchemy import SQLAlchemy
 import json
 from dotenv import load_dotenv
+
+from .dbpool import PooledSQLAlchemy
  
 load_dotenv()
 
@@ -10,7 +11,7 @@ database_filename = os.getenv('DB_NAME')
 project_dir = os.path.dirname(os.path.abspath(__file__))
 database_path = os.getenv('DB_PATH')
 
-db = SQLAlchemy()
+db = PooledSQLAlchemy()
 
 '''
 setup_db(app)
@@ -1,5 +1,6 @@
 import os
 from models import setup_db
+from sqlprofile import sql_profiler
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
@@ -9,6 +10,7 @@ def create_app(test_config=None):
   app = Flask(__name__)
   CORS(app)
   setup_db(app)
+  sql_profiler.init_app(app)
 
   return app
 